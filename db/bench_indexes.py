@@ -0,0 +1,143 @@
+"""lookupインデックスの効果を計測するベンチマーク
+
+benchスキーマに本番と同じ列構成のテーブルを作成して100k行を投入し、
+インデックス作成前後でlookupクエリの実行時間を比較する。
+
+    python bench_indexes.py [rows] [repeat]
+"""
+
+import sys
+import time
+
+from sqlalchemy import text
+
+from package.connection import engine
+
+SCHEMA = "bench"
+
+TABLES = ["user_session_storage", "participants", "voice_chat_logs", "text_chat_logs"]
+
+SEED = {
+    "user_session_storage": """
+        INSERT INTO bench.user_session_storage (id, user_id, data, created_at, updated_at)
+        SELECT i, 100000000000000000 + i, '{}'::json, now(), now()
+        FROM generate_series(1, :rows) AS i
+    """,
+    "participants": """
+        INSERT INTO bench.participants
+            (id, last_name, first_name, group_id, github_user_name, discord_user_id,
+             created_at, updated_at)
+        SELECT i, 'last' || i, 'first' || i, i % 50, 'user' || i,
+               100000000000000000 + i, now(), now()
+        FROM generate_series(1, :rows) AS i
+    """,
+    "voice_chat_logs": """
+        INSERT INTO bench.voice_chat_logs
+            (id, channel_id, team_id, start_time, end_time, created_at, updated_at)
+        SELECT i, 200000000000000000 + i % 500, (i % 200)::text,
+               now() - (i || ' seconds')::interval,
+               CASE WHEN i % 100 = 0 THEN NULL ELSE now() END, now(), now()
+        FROM generate_series(1, :rows) AS i
+    """,
+    "text_chat_logs": """
+        INSERT INTO bench.text_chat_logs
+            (id, team_id, channel_id, message_id, created_at, updated_at)
+        SELECT i, (i % 200)::text, 200000000000000000 + i % 500,
+               300000000000000000 + i, now(), now()
+        FROM generate_series(1, :rows) AS i
+    """,
+}
+
+INDEXES = [
+    "CREATE UNIQUE INDEX ON bench.user_session_storage (user_id)",
+    "CREATE UNIQUE INDEX ON bench.participants (discord_user_id)",
+    "CREATE INDEX ON bench.voice_chat_logs (channel_id, start_time)",
+    "CREATE INDEX ON bench.text_chat_logs (team_id)",
+]
+
+QUERIES = {
+    "session by user_id": (
+        "SELECT * FROM bench.user_session_storage WHERE user_id = :v",
+        {"v": 100000000000012345},
+    ),
+    "participant by discord_user_id": (
+        "SELECT * FROM bench.participants WHERE discord_user_id = :v",
+        {"v": 100000000000054321},
+    ),
+    "open voice log by channel": (
+        (
+            "SELECT * FROM bench.voice_chat_logs WHERE channel_id = :v "
+            "ORDER BY start_time DESC LIMIT 1"
+        ),
+        {"v": 200000000000000123},
+    ),
+    "text logs by team_id": (
+        "SELECT count(*) FROM bench.text_chat_logs WHERE team_id = :v",
+        {"v": "42"},
+    ),
+}
+
+
+def measure(conn, repeat: int) -> dict[str, float]:
+    """各クエリの平均実行時間（ms）"""
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        # 1回目はキャッシュ温め
+        conn.execute(text(sql), params).all()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(text(sql), params).all()
+        results[name] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def explain(conn, sql: str, params: dict) -> str:
+    plan = conn.execute(text(f"EXPLAIN {sql}"), params).scalars().all()
+    return plan[0].strip()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        for table in TABLES:
+            # インデックス・制約なしで列構成だけコピー
+            conn.execute(text(f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table})"))
+            conn.execute(text(SEED[table]), {"rows": rows})
+            conn.execute(text(f"ANALYZE {SCHEMA}.{table}"))
+
+    try:
+        with engine.connect() as conn:
+            before = measure(conn, repeat)
+            before_plans = {n: explain(conn, *q) for n, q in QUERIES.items()}
+
+        with engine.begin() as conn:
+            for ddl in INDEXES:
+                conn.execute(text(ddl))
+            for table in TABLES:
+                conn.execute(text(f"ANALYZE {SCHEMA}.{table}"))
+
+        with engine.connect() as conn:
+            after = measure(conn, repeat)
+            after_plans = {n: explain(conn, *q) for n, q in QUERIES.items()}
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+    print(f"rows={rows} repeat={repeat}")
+    print(f"{'query':<34}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<34}{before[name]:>14.3f}{after[name]:>14.3f}{speedup:>9.1f}x")
+    print()
+    for name in QUERIES:
+        print(f"{name}:")
+        print(f"  before: {before_plans[name]}")
+        print(f"  after:  {after_plans[name]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,85 @@
+import asyncio
+import hashlib
+import json
 import logging
 import os
 import subprocess
 import sys
+import tarfile
+import tempfile
 import time
+import zlib
 from datetime import datetime, timedelta
 from typing import List, Optional
 
 import boto3
-import schedule
 import sentry_sdk
 from botocore.exceptions import ClientError
 from pick import pick
 
+import retention
+from package.rollup_sql import REBUILD_SQL
+from scheduler import Job, Scheduler
+
 # S3設定
 S3_ENDPOINT = os.environ["S3_ENDPOINT"]
 S3_ACCESS_KEY = os.environ["S3_ACCESS_KEY"]
 S3_SECRET_KEY = os.environ["S3_SECRET_KEY"]
 S3_BUCKET = os.environ["S3_BUCKET"]
 BACKUP_DIR = os.environ.get("BACKUP_DIR", "default")
+# 差分バックアップの保存先と、前回の差分の終端を記録するオブジェクト
+INCREMENTAL_DIR = f"{BACKUP_DIR}/incremental"
+WATERMARK_KEY = f"{INCREMENTAL_DIR}/watermark.json"
 
 # ライフサイクル設定
 BACKUP_RETENTION_DAYS = int(os.environ.get("BACKUP_RETENTION_DAYS", 30))
+# 保持ポリシー（例: "daily:30,weekly:365"。未指定の場合はBACKUP_RETENTION_DAYS日分）
+BACKUP_RETENTION_POLICY = os.environ.get(
+    "BACKUP_RETENTION_POLICY", f"daily:{BACKUP_RETENTION_DAYS}"
+)
+BACKUP_DELETE_CONCURRENCY = int(os.environ.get("BACKUP_DELETE_CONCURRENCY", 4))
 BACKUP_TIME = os.environ.get("BACKUP_TIME", "03:00")
 
+# 各ジョブの実行スケジュール（cron形式。バックアップは未指定の場合BACKUP_TIMEに実行し、
+# 検証は未指定の場合は実行しない）
+BACKUP_CRON = os.environ.get(
+    "BACKUP_CRON",
+    f"{int(BACKUP_TIME.split(':')[1])} {int(BACKUP_TIME.split(':')[0])} * * *",
+)
+RETENTION_CRON = os.environ.get("RETENTION_CRON", "30 4 * * *")
+VERIFY_CRON = os.environ.get("VERIFY_CRON", "")
+# ジョブの実行状況を返すHTTPサーバのポート
+SCHEDULER_STATUS_PORT = int(os.environ.get("SCHEDULER_STATUS_PORT", 8080))
+
+# バックアップ方式（full: 毎回全体, incremental: 定期的な全体＋ログテーブルの差分）
+BACKUP_MODE = os.environ.get("BACKUP_MODE", "full")
+FULL_BACKUP_INTERVAL_DAYS = int(os.environ.get("FULL_BACKUP_INTERVAL_DAYS", 7))
+# 差分バックアップの対象（updated_atが前回以降の行を取り出す）
+INCREMENTAL_TABLES = ("text_chat_logs", "voice_chat_logs")
+# 前回の終端より前にコミットされていなかった行を取りこぼさないよう、範囲を重ねる時間
+INCREMENTAL_OVERLAP_MINUTES = 10
+
+# 圧縮形式（zstd, gzip, none）とマルチパートアップロードのパートサイズ
+BACKUP_COMPRESSION = os.environ.get("BACKUP_COMPRESSION", "gzip")
+BACKUP_PART_SIZE = int(os.environ.get("BACKUP_PART_SIZE_MB", 16)) * 1024 * 1024
+
+# ダンプ形式（plain, custom, directory）と並列数（directory形式のダンプ、pg_restore）
+# plain形式はローカルに保存せずに復元する。pg_restoreを並列に実行する場合
+# （custom形式でBACKUP_JOBSが2以上、またはdirectory形式）は、ダウンロードした
+# ダンプを一時ファイルに保存してから復元するため、ダンプと同じサイズの空き容量が必要。
+BACKUP_FORMAT = os.environ.get("BACKUP_FORMAT", "plain")
+BACKUP_JOBS = int(os.environ.get("BACKUP_JOBS", 4))
+
+# plain形式の圧縮形式ごとのバックアップファイルの拡張子
+BACKUP_EXTENSIONS = {"none": ".sql", "gzip": ".sql.gz", "zstd": ".sql.zst"}
+# custom/directory形式の拡張子（圧縮はpg_dumpが行い、directory形式はtarにまとめる）
+FORMAT_EXTENSIONS = {"custom": ".dump", "directory": ".tar"}
+BACKUP_SUFFIXES = (*BACKUP_EXTENSIONS.values(), *FORMAT_EXTENSIONS.values())
+# パイプから読み込む単位
+CHUNK_SIZE = 1024 * 1024
+# S3のマルチパートアップロードの最小パートサイズ（最後のパートを除く）
+MIN_PART_SIZE = 5 * 1024 * 1024
+
 # データベース設定
 DB_HOST = os.environ["POSTGRES_HOST"]
 DB_NAME = os.environ["POSTGRES_DB"]
@@ -48,6 +105,14 @@ def get_s3_client():
     )
 
 
+def backup_extension(
+    backup_format: str = BACKUP_FORMAT, compression: str = BACKUP_COMPRESSION
+) -> str:
+    if backup_format == "plain":
+        return BACKUP_EXTENSIONS[compression]
+    return FORMAT_EXTENSIONS[backup_format]
+
+
 def ensure_backup_directory(s3_client):
     """バックアップディレクトリの存在確認と作成"""
     try:
@@ -73,19 +138,11 @@ def list_backup_files(s3_client) -> List[str]:
     """バックアップファイルの一覧を取得"""
     backup_files = []
     try:
-        paginator = s3_client.get_paginator("list_objects_v2")
-        for page in paginator.paginate(
-            Bucket=S3_BUCKET, Prefix=f"{BACKUP_DIR}/backup_"
+        for filename in retention.list_keys(
+            s3_client, S3_BUCKET, f"{BACKUP_DIR}/backup_"
         ):
-            if "Contents" not in page:
-                continue
-
-            for obj in page["Contents"]:
-                filename = obj["Key"]
-                if filename.startswith(f"{BACKUP_DIR}/backup_") and filename.endswith(
-                    ".sql"
-                ):
-                    backup_files.append(filename)
+            if filename.endswith(BACKUP_SUFFIXES):
+                backup_files.append(filename)
 
         # 日付順に並び替え（新しい順）
         backup_files.sort(reverse=True)
@@ -97,61 +154,33 @@ def list_backup_files(s3_client) -> List[str]:
     return backup_files
 
 
-def list_old_backups(s3_client) -> List[str]:
-    """指定した日数より古いバックアップを一覧取得"""
-    cutoff_date = datetime.now() - timedelta(days=BACKUP_RETENTION_DAYS)
-    old_backups = []
-
+def delete_old_backups(s3_client, dry_run: bool = False):
+    """保持ポリシーから外れたバックアップを削除"""
     try:
-        # 指定されたディレクトリ内のオブジェクトを取得
-        paginator = s3_client.get_paginator("list_objects_v2")
-        for page in paginator.paginate(
-            Bucket=S3_BUCKET, Prefix=f"{BACKUP_DIR}/backup_"
-        ):
-            if "Contents" not in page:
-                continue
-
-            for obj in page["Contents"]:
-                filename = ""
-                try:
-                    filename = obj["Key"]
-                    # バックアップファイルのみを対象とする
-                    if not filename.startswith(f"{BACKUP_DIR}/backup_"):
-                        continue
-
-                    date_str = filename.split("_")[1]
-                    file_date = datetime.strptime(date_str, "%Y%m%d")
-
-                    if file_date < cutoff_date:
-                        old_backups.append(filename)
-                except (IndexError, ValueError) as e:
-                    sentry_sdk.capture_exception(e)
-                    LOGGER.error(
-                        f"Warning: Could not parse date from filename: {filename}"
-                    )
-                    continue
-
-    except Exception as e:
-        sentry_sdk.capture_exception(e)
-        LOGGER.error(f"Error listing old backups: {str(e)}")
-
-    return old_backups
-
-
-def delete_old_backups(s3_client, old_backups: List[str]):
-    """古いバックアップを削除"""
-    if not old_backups:
-        return
-
-    try:
-        objects_to_delete = [{"Key": key} for key in old_backups]
-        s3_client.delete_objects(
-            Bucket=S3_BUCKET, Delete={"Objects": objects_to_delete}
+        result = retention.apply_retention(
+            s3_client,
+            S3_BUCKET,
+            BACKUP_DIR,
+            retention.parse_policy(BACKUP_RETENTION_POLICY),
+            concurrency=BACKUP_DELETE_CONCURRENCY,
+            dry_run=dry_run,
         )
-        LOGGER.info(f"Deleted {len(old_backups)} old backup(s) from {BACKUP_DIR}/")
     except Exception as e:
         sentry_sdk.capture_exception(e)
         LOGGER.error(f"Error deleting old backups: {str(e)}")
+        return None
+
+    if dry_run:
+        for key in result.expired:
+            LOGGER.info(f"Would delete: {key}")
+    LOGGER.info(f"Retention for {BACKUP_DIR}/: {result.summary()}")
+    if result.errors:
+        sentry_sdk.capture_message(
+            f"Failed to delete {len(result.errors)} old backup object(s) "
+            f"from {BACKUP_DIR}/",
+            level="error",
+        )
+    return result
 
 
 def select_backup_file() -> Optional[str]:
@@ -168,7 +197,7 @@ def select_backup_file() -> Optional[str]:
         display_options = []
         for filename in backup_files:
             try:
-                # backup_YYYYMMDD_HHMMSS.sql の形式から日時を抽出
+                # backup_YYYYMMDD_HHMMSS.<拡張子> の形式から日時を抽出
                 date_str = filename.split("_")[1]
                 time_str = filename.split("_")[2].split(".")[0]
                 display_date = f"{date_str[:4]}/{date_str[4:6]}/{date_str[6:]} {time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
@@ -188,54 +217,428 @@ def select_backup_file() -> Optional[str]:
         return None
 
 
-def create_backup():
-    """バックアップを作成してS3にアップロード"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = f"/tmp/backup_{timestamp}.sql"
+class S3MultipartWriter:
+    """書き込まれたデータをパート単位でS3にマルチパートアップロードする
 
-    try:
-        # pg_dumpを実行
+    メモリに保持するのは1パート分のみで、書き込んだデータのSHA-256も計算する。
+    """
+
+    def __init__(self, s3_client, key: str, part_size: int = BACKUP_PART_SIZE):
+        self.s3_client = s3_client
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = None
+
+    def __enter__(self):
+        response = self.s3_client.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=self.key
+        )
+        self._upload_id = response["UploadId"]
+        return self
+
+    def write(self, data: bytes):
+        self.sha256.update(data)
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+
+    def _upload_part(self, data: bytes):
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=S3_BUCKET,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def _complete(self):
+        # 最後のパート（データが空でも1パートは必要）
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        self.s3_client.complete_multipart_upload(
+            Bucket=S3_BUCKET,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def _abort(self):
         try:
-            run = subprocess.run(
-                [
-                    "pg_dump",
-                    f"--host={DB_HOST}",
-                    f"--dbname={DB_NAME}",
-                    f"--username={DB_USER}",
-                    "--format=plain",
-                    f"--file={backup_file}",
-                ],
-                env={"PGPASSWORD": DB_PASSWORD},
-                check=True,
-                capture_output=True,
-                text=True,
+            self.s3_client.abort_multipart_upload(
+                Bucket=S3_BUCKET, Key=self.key, UploadId=self._upload_id
             )
-            LOGGER.info(run.stdout)
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             sentry_sdk.capture_exception(e)
-            LOGGER.error(f"Error running pg_dump: {e.stderr}")
-            LOGGER.error(f"pg_dump output: {e.stdout}")
-            raise e
+            LOGGER.error(f"Error aborting multipart upload {self.key}: {str(e)}")
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._abort()
+            return False
+        try:
+            self._complete()
+        except Exception:
+            self._abort()
+            raise
+        return False
+
 
+def save_checksum(s3_client, key: str, sha256: str):
+    """アップロード済みのオブジェクトのSHA-256を <キー>.sha256 に保存
+
+    copy_objectでメタデータを書き換える方法は5GBを超えるオブジェクトで失敗するため、
+    sha256sumと同じ形式の別オブジェクトにする。
+    """
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=f"{key}{retention.CHECKSUM_SUFFIX}",
+        Body=f"{sha256}  {os.path.basename(key)}\n".encode(),
+        ContentType="text/plain",
+    )
+
+
+def load_checksum(s3_client, key: str) -> Optional[str]:
+    """保存されたSHA-256を取得（ない場合はNone）"""
+    try:
+        body = s3_client.get_object(
+            Bucket=S3_BUCKET, Key=f"{key}{retention.CHECKSUM_SUFFIX}"
+        )["Body"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        # 以前のバックアップはメタデータに保存している
+        return (
+            s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+            .get("Metadata", {})
+            .get("sha256")
+        )
+    return body.read().decode().split()[0]
+
+
+def _kill_processes(processes: List[subprocess.Popen]):
+    for process in processes:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def _wait_processes(processes: List[subprocess.Popen], stderr_file):
+    """パイプラインの全プロセスの終了を待ち、失敗した場合はCalledProcessErrorを送出"""
+    for process in processes:
+        process.wait()
+    for process in processes:
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(
+                process.returncode,
+                process.args,
+                stderr=stderr_file.read().decode(errors="replace"),
+            )
+
+
+def stream_dump(
+    writer: S3MultipartWriter,
+    backup_format: str = BACKUP_FORMAT,
+    compression: str = BACKUP_COMPRESSION,
+):
+    """pg_dumpの出力を圧縮しながらwriterに書き込む（ローカルには保存しない）"""
+    if backup_format == "directory":
+        dump_directory(writer)
+        return
+    if backup_format == "custom":
+        # custom形式はpg_dumpが圧縮する
+        compression = "none"
+
+    stream_command(
+        [
+            "pg_dump",
+            f"--host={DB_HOST}",
+            f"--dbname={DB_NAME}",
+            f"--username={DB_USER}",
+            f"--format={backup_format}",
+        ],
+        writer,
+        compression,
+    )
+
+
+def stream_command(command: List[str], writer: S3MultipartWriter, compression: str):
+    """コマンドの標準出力を圧縮しながらwriterに書き込む"""
+    with tempfile.TemporaryFile() as stderr:
+        processes = [
+            subprocess.Popen(
+                command,
+                env={"PGPASSWORD": DB_PASSWORD},
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+            )
+        ]
+        if compression == "zstd":
+            processes.append(
+                subprocess.Popen(
+                    ["zstd", "--quiet", "--stdout", "--threads=0"],
+                    stdin=processes[0].stdout,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                )
+            )
+            # zstdが異常終了した場合に元のコマンドも終了するよう、こちら側の読み口は閉じる
+            processes[0].stdout.close()
+        compressor = zlib.compressobj(wbits=31) if compression == "gzip" else None
+
+        output = processes[-1].stdout
+        try:
+            while chunk := output.read(CHUNK_SIZE):
+                writer.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                writer.write(compressor.flush())
+        except BaseException:
+            _kill_processes(processes)
+            raise
+        finally:
+            output.close()
+        _wait_processes(processes, stderr)
+
+
+def dump_directory(writer: S3MultipartWriter):
+    """directory形式で並列にダンプし、tarにまとめながらwriterに書き込む
+
+    directory形式は標準出力に書き出せないため一時ディレクトリを経由する
+    （各ファイルはpg_dumpが圧縮するため、必要な容量は圧縮後のサイズ分）。
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dump_dir = os.path.join(tmpdir, "dump")
+        subprocess.run(
+            [
+                "pg_dump",
+                f"--host={DB_HOST}",
+                f"--dbname={DB_NAME}",
+                f"--username={DB_USER}",
+                "--format=directory",
+                f"--jobs={BACKUP_JOBS}",
+                f"--file={dump_dir}",
+            ],
+            env={"PGPASSWORD": DB_PASSWORD},
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            tar.add(dump_dir, arcname="dump")
+
+
+class _HashingReader:
+    """読み込んだデータのSHA-256を計算しながらS3のレスポンスを読む"""
+
+    def __init__(self, body):
+        self.body = body
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = CHUNK_SIZE) -> bytes:
+        data = self.body.read(size)
+        self.sha256.update(data)
+        return data
+
+    def iter_chunks(self, size: int = CHUNK_SIZE):
+        while chunk := self.read(size):
+            yield chunk
+
+
+def stream_restore(s3_client, backup_file: str):
+    """S3のバックアップをダウンロードしながら復元する"""
+    expected = load_checksum(s3_client, backup_file)
+    reader = _HashingReader(
+        s3_client.get_object(Bucket=S3_BUCKET, Key=backup_file)["Body"]
+    )
+
+    if backup_file.endswith(FORMAT_EXTENSIONS["directory"]):
+        restore_directory(reader)
+    elif backup_file.endswith(FORMAT_EXTENSIONS["custom"]) and BACKUP_JOBS > 1:
+        restore_custom(reader)
+    else:
+        restore_stream(reader, backup_file)
+
+    if expected is not None and reader.sha256.hexdigest() != expected:
+        raise ValueError(
+            f"Checksum mismatch for {backup_file}: "
+            f"expected {expected}, got {reader.sha256.hexdigest()}"
+        )
+
+
+def restore_stream(reader: _HashingReader, backup_file: str):
+    """plain形式は展開しながらpsqlに、custom形式はpg_restoreの標準入力に流し込む
+
+    ローカルの空き容量を使わないが、標準入力からだとpg_restoreは並列化できない。
+    """
+    if backup_file.endswith(FORMAT_EXTENSIONS["custom"]):
+        command = [
+            "pg_restore",
+            f"--host={DB_HOST}",
+            f"--dbname={DB_NAME}",
+            f"--username={DB_USER}",
+        ]
+    else:
+        command = [
+            "psql",
+            f"--host={DB_HOST}",
+            f"--dbname={DB_NAME}",
+            f"--username={DB_USER}",
+            "--quiet",
+            "--file=-",
+        ]
+
+    with tempfile.TemporaryFile() as stderr:
+        restore = subprocess.Popen(
+            command,
+            env={"PGPASSWORD": DB_PASSWORD},
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+        )
+        processes = [restore]
+        sink = restore.stdin
+        if backup_file.endswith(".zst"):
+            zstd = subprocess.Popen(
+                ["zstd", "--decompress", "--quiet", "--stdout"],
+                stdin=subprocess.PIPE,
+                stdout=restore.stdin,
+                stderr=stderr,
+            )
+            restore.stdin.close()
+            processes.insert(0, zstd)
+            sink = zstd.stdin
+        decompressor = (
+            zlib.decompressobj(wbits=31) if backup_file.endswith(".gz") else None
+        )
+
+        try:
+            for chunk in reader.iter_chunks():
+                sink.write(decompressor.decompress(chunk) if decompressor else chunk)
+            if decompressor:
+                sink.write(decompressor.flush())
+            sink.close()
+        except BrokenPipeError:
+            # 後段のプロセスが先に終了した（原因は終了コードとstderrで報告する）
+            _wait_processes(processes, stderr)
+            raise
+        except BaseException:
+            _kill_processes(processes)
+            raise
+        _wait_processes(processes, stderr)
+
+
+def restore_custom(reader: _HashingReader):
+    """custom形式を一時ファイルにダウンロードし、pg_restoreで並列に復元する
+
+    pg_restoreの並列化にはシーク可能なファイルが必要なため、
+    ダンプと同じサイズの空き容量を使う代わりに復元の時間を短くする。
+    """
+    with tempfile.NamedTemporaryFile(suffix=FORMAT_EXTENSIONS["custom"]) as dump_file:
+        for chunk in reader.iter_chunks():
+            dump_file.write(chunk)
+        dump_file.flush()
+
+        subprocess.run(
+            [
+                "pg_restore",
+                f"--host={DB_HOST}",
+                f"--dbname={DB_NAME}",
+                f"--username={DB_USER}",
+                f"--jobs={BACKUP_JOBS}",
+                dump_file.name,
+            ],
+            env={"PGPASSWORD": DB_PASSWORD},
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+
+
+def restore_directory(reader: _HashingReader):
+    """tarを展開しながら一時ディレクトリに書き出し、pg_restoreで並列に復元する
+
+    展開が終わるまでpg_restoreを開始できないため、ダンプと同じサイズの空き容量を使い、
+    ダウンロードと復元の時間が合計でかかる。
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            tar.extractall(tmpdir, filter="data")
+        # チェックサムの計算のため、tarの終端以降も読み切る
+        for _ in reader.iter_chunks():
+            pass
+
+        subprocess.run(
+            [
+                "pg_restore",
+                f"--host={DB_HOST}",
+                f"--dbname={DB_NAME}",
+                f"--username={DB_USER}",
+                f"--jobs={BACKUP_JOBS}",
+                os.path.join(tmpdir, "dump"),
+            ],
+            env={"PGPASSWORD": DB_PASSWORD},
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+
+
+def create_backup(update_watermark: bool = True):
+    """バックアップを作成し、圧縮しながらS3にアップロード
+
+    update_watermarkがFalseの場合は、差分バックアップの起点として記録しない。
+    """
+    update_watermark = update_watermark and BACKUP_MODE == "incremental"
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    s3_key = f"{BACKUP_DIR}/backup_{timestamp}{backup_extension()}"
+
+    try:
         # S3クライアントの初期化
         s3_client = get_s3_client()
 
         # バックアップディレクトリの確認/作成
         ensure_backup_directory(s3_client)
 
-        # S3にアップロード
-        s3_key = f"{BACKUP_DIR}/backup_{timestamp}.sql"
-        s3_client.upload_file(backup_file, S3_BUCKET, s3_key)
+        # ダンプ開始前のDB時刻（以降の差分バックアップの起点）
+        if update_watermark:
+            started_at = query_db_now()
+
+        # pg_dumpの出力をS3にストリーミング
+        start = time.monotonic()
+        try:
+            with S3MultipartWriter(s3_client, s3_key) as writer:
+                stream_dump(writer)
+        except subprocess.CalledProcessError as e:
+            sentry_sdk.capture_exception(e)
+            LOGGER.error(f"Error running pg_dump: {e.stderr}")
+            raise e
 
-        LOGGER.info(f"Backup completed successfully: {s3_key}")
+        save_checksum(s3_client, s3_key, writer.sha256.hexdigest())
 
-        # 古いバックアップの削除
-        old_backups = list_old_backups(s3_client)
-        if old_backups:
-            delete_old_backups(s3_client, old_backups)
+        LOGGER.info(
+            f"Backup completed successfully: {s3_key} "
+            f"({writer.size} bytes, {time.monotonic() - start:.1f}s)"
+        )
 
-        # 一時ファイルを削除
-        os.remove(backup_file)
+        if update_watermark:
+            save_watermark(
+                s3_client,
+                {
+                    "full_backup": s3_key,
+                    "full_backup_date": now.date().isoformat(),
+                    "watermark": started_at,
+                },
+            )
 
         # filenameを返す
         return s3_key
@@ -245,16 +648,347 @@ def create_backup():
         LOGGER.error(f"Backup failed: {str(e)}")
 
 
-def restore_backup(backup_file: str):
-    """バックアップをリストア"""
+def query_db_now() -> str:
+    """DBの現在時刻（差分の範囲はDB側の時計で決める）"""
+    run = subprocess.run(
+        [
+            "psql",
+            f"--host={DB_HOST}",
+            f"--dbname={DB_NAME}",
+            f"--username={DB_USER}",
+            "--no-align",
+            "--tuples-only",
+            "-c",
+            "SELECT now()",
+        ],
+        env={"PGPASSWORD": DB_PASSWORD},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return run.stdout.strip()
+
+
+def load_watermark(s3_client) -> Optional[dict]:
+    """直近のフルバックアップと、差分バックアップ済みの終端時刻を取得"""
+    try:
+        body = s3_client.get_object(Bucket=S3_BUCKET, Key=WATERMARK_KEY)["Body"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return json.loads(body.read())
+
+
+def save_watermark(s3_client, watermark: dict):
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=WATERMARK_KEY,
+        Body=json.dumps(watermark).encode(),
+        ContentType="application/json",
+    )
+
+
+def incremental_prefix(full_backup: str) -> str:
+    """フルバックアップに続く差分バックアップの保存先"""
+    name = os.path.basename(full_backup).split(".")[0]
+    return f"{INCREMENTAL_DIR}/{name}/"
+
+
+def list_incremental_chunks(s3_client, full_backup: str) -> List[str]:
+    """フルバックアップに続く差分バックアップの一覧を取得（古い順）"""
+    chunks = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=S3_BUCKET, Prefix=incremental_prefix(full_backup)
+    ):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(".csv.gz"):
+                chunks.append(obj["Key"])
+    return sorted(chunks)
+
+
+def export_table_changes(
+    writer: S3MultipartWriter, table: str, since: str, until: str
+):
+    """sinceより後、until以前に更新された行をCSVでwriterに書き込む"""
+    query = (
+        f"SELECT * FROM {table} "
+        f"WHERE updated_at > timestamptz '{since}' "
+        f"- interval '{INCREMENTAL_OVERLAP_MINUTES} minutes' "
+        f"AND updated_at <= timestamptz '{until}' ORDER BY id"
+    )
+    stream_command(
+        [
+            "psql",
+            f"--host={DB_HOST}",
+            f"--dbname={DB_NAME}",
+            f"--username={DB_USER}",
+            "-c",
+            f"\\copy ({query}) TO STDOUT WITH (FORMAT csv, HEADER)",
+        ],
+        writer,
+        "gzip",
+    )
+
+
+def create_incremental_backup():
+    """前回のバックアップ以降に更新されたログテーブルの行をS3にアップロード
+
+    差分の起点がない場合や、前回のフルバックアップから
+    FULL_BACKUP_INTERVAL_DAYS日以上経過した場合はフルバックアップを作成する。
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    local_file = f"/tmp/restore_{timestamp}.sql"
 
     try:
-        # S3からファイルをダウンロード
         s3_client = get_s3_client()
-        LOGGER.info(f"Downloading backup file: {backup_file}")
-        s3_client.download_file(S3_BUCKET, backup_file, local_file)
+        watermark = load_watermark(s3_client)
+        if watermark is None or (
+            datetime.now().date()
+            - datetime.fromisoformat(watermark["full_backup_date"]).date()
+        ) >= timedelta(days=FULL_BACKUP_INTERVAL_DAYS):
+            LOGGER.info("Full backup is due")
+            return create_backup()
+
+        until = query_db_now()
+        prefix = incremental_prefix(watermark["full_backup"])
+        start = time.monotonic()
+        size = 0
+        for table in INCREMENTAL_TABLES:
+            s3_key = f"{prefix}{timestamp}_{table}.csv.gz"
+            try:
+                with S3MultipartWriter(s3_client, s3_key) as writer:
+                    export_table_changes(writer, table, watermark["watermark"], until)
+            except subprocess.CalledProcessError as e:
+                sentry_sdk.capture_exception(e)
+                LOGGER.error(f"Error exporting {table}: {e.stderr}")
+                raise e
+            save_checksum(s3_client, s3_key, writer.sha256.hexdigest())
+            size += writer.size
+
+        # 全テーブルの書き出しが成功した場合のみ終端を進める
+        save_watermark(s3_client, {**watermark, "watermark": until})
+
+        LOGGER.info(
+            f"Incremental backup completed successfully: {prefix}{timestamp}_* "
+            f"({size} bytes, {time.monotonic() - start:.1f}s)"
+        )
+        # 今回作成したファイルに共通するプレフィックスを返す
+        return f"{prefix}{timestamp}_"
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        LOGGER.error(f"Incremental backup failed: {str(e)}")
+
+
+def run_backup():
+    """BACKUP_MODEに応じたバックアップを作成"""
+    if BACKUP_MODE == "incremental":
+        return create_incremental_backup()
+    return create_backup()
+
+
+def verify_checksum(s3_client, key: str) -> int:
+    """オブジェクトをダウンロードして保存されたSHA-256と照合し、サイズを返す"""
+    expected = load_checksum(s3_client, key)
+    if expected is None:
+        raise ValueError(f"No checksum stored for {key}")
+    reader = _HashingReader(s3_client.get_object(Bucket=S3_BUCKET, Key=key)["Body"])
+    size = sum(len(chunk) for chunk in reader.iter_chunks())
+    if reader.sha256.hexdigest() != expected:
+        raise ValueError(f"Checksum mismatch for {key}")
+    return size
+
+
+def stored_size(s3_client, prefix: str) -> int:
+    """プレフィックスに一致するオブジェクトの合計サイズ"""
+    size = 0
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        size += sum(obj["Size"] for obj in page.get("Contents", []))
+    return size
+
+
+def backup_job() -> dict:
+    key = run_backup()
+    if key is None:
+        raise RuntimeError("Backup failed")
+    return {"key": key, "size": stored_size(get_s3_client(), key)}
+
+
+def retention_job() -> dict:
+    result = delete_old_backups(get_s3_client())
+    if result is None:
+        raise RuntimeError("Retention failed")
+    if result.errors:
+        raise RuntimeError(f"Failed to delete {len(result.errors)} object(s)")
+    return {"kept": len(result.kept), "deleted": result.deleted}
+
+
+def verify_job() -> dict:
+    """最新のバックアップのチェックサムを確認"""
+    s3_client = get_s3_client()
+    backup_files = list_backup_files(s3_client)
+    if not backup_files:
+        raise RuntimeError("No backup files found")
+    size = verify_checksum(s3_client, backup_files[0])
+    LOGGER.info(f"Verified backup: {backup_files[0]} ({size} bytes)")
+    return {"key": backup_files[0], "size": size}
+
+
+def replay_incremental_chunk(s3_client, chunk: str):
+    """差分バックアップを一時テーブル経由でUPSERTする"""
+    # <YYYYMMDD>_<HHMMSS>_<テーブル名>.csv.gz
+    table = os.path.basename(chunk).split("_", 2)[2].removesuffix(".csv.gz")
+    if table not in INCREMENTAL_TABLES:
+        raise ValueError(f"Unknown table in incremental backup: {chunk}")
+
+    expected = load_checksum(s3_client, chunk)
+    reader = _HashingReader(s3_client.get_object(Bucket=S3_BUCKET, Key=chunk)["Body"])
+    decompressor = zlib.decompressobj(wbits=31)
+
+    with tempfile.TemporaryFile() as stderr:
+        psql = None
+        header = b""
+        try:
+            for chunk_data in reader.iter_chunks():
+                data = decompressor.decompress(chunk_data)
+                if psql is None:
+                    # CSVのヘッダから列を決めてからpsqlを起動する
+                    header += data
+                    if b"\n" not in header:
+                        continue
+                    columns_line, data = header.split(b"\n", 1)
+                    psql = _start_replay(table, columns_line.decode(), stderr)
+                psql.stdin.write(data)
+            if psql is None:
+                raise ValueError(f"Incremental backup has no header: {chunk}")
+            psql.stdin.write(decompressor.flush())
+            psql.stdin.close()
+        except BrokenPipeError:
+            _wait_processes([psql], stderr)
+            raise
+        except BaseException:
+            if psql is not None:
+                _kill_processes([psql])
+            raise
+        _wait_processes([psql], stderr)
+
+    if expected is not None and reader.sha256.hexdigest() != expected:
+        raise ValueError(f"Checksum mismatch for {chunk}")
+
+
+def _start_replay(table: str, columns_line: str, stderr) -> subprocess.Popen:
+    columns = columns_line.strip().split(",")
+    if not all(column.isidentifier() for column in columns):
+        raise ValueError(f"Invalid CSV header for {table}: {columns_line}")
+    column_list = ", ".join(columns)
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}" for column in columns if column != "id"
+    )
+    return subprocess.Popen(
+        [
+            "psql",
+            f"--host={DB_HOST}",
+            f"--dbname={DB_NAME}",
+            f"--username={DB_USER}",
+            "--quiet",
+            "--set=ON_ERROR_STOP=1",
+            "-c",
+            "BEGIN",
+            "-c",
+            f"CREATE TEMP TABLE incremental_rows (LIKE {table} INCLUDING DEFAULTS)",
+            "-c",
+            f"\\copy incremental_rows ({column_list}) FROM pstdin WITH (FORMAT csv)",
+            "-c",
+            f"INSERT INTO {table} ({column_list}) "
+            f"SELECT {column_list} FROM incremental_rows "
+            f"ON CONFLICT (id) DO UPDATE SET {updates}",
+            "-c",
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT max(id) FROM {table}))",
+            "-c",
+            "COMMIT",
+        ],
+        env={"PGPASSWORD": DB_PASSWORD},
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=stderr,
+    )
+
+
+def select_incremental_chunks(chunks: List[str]) -> List[str]:
+    """どの時点の差分バックアップまで適用するかを選択"""
+    # 同じ時刻に作成されたテーブルごとのファイルをまとめて1つの時点とする
+    points = sorted({os.path.basename(chunk)[:15] for chunk in chunks})
+    full_only = "(full backup only)"
+    title = "Please select a point to replay incremental backups up to:"
+    selected_option, _ = pick([full_only, *reversed(points)], title)
+    if selected_option == full_only:
+        return []
+    return [
+        chunk for chunk in chunks if os.path.basename(chunk)[:15] <= selected_option
+    ]
+
+
+def rebuild_rollups():
+    """差分を適用したログテーブルから、ロールアップ（team_activity_hourly）を再構築"""
+    command = [
+        "psql",
+        f"--host={DB_HOST}",
+        f"--dbname={DB_NAME}",
+        f"--username={DB_USER}",
+        "--quiet",
+        "--set=ON_ERROR_STOP=1",
+        "-c",
+        "BEGIN",
+    ]
+    for sql in REBUILD_SQL:
+        command += ["-c", sql]
+    command += ["-c", "COMMIT"]
+    subprocess.run(
+        command,
+        env={"PGPASSWORD": DB_PASSWORD},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def restore_incremental(s3_client, chunks: List[str]):
+    """差分バックアップを古い順に適用し、ロールアップを再構築
+
+    差分バックアップにはログテーブルのみが含まれるため、ロールアップは
+    フルバックアップ時点のままになっている。
+    """
+    start = time.monotonic()
+    for chunk in chunks:
+        LOGGER.info(f"Replaying incremental backup: {chunk}")
+        try:
+            replay_incremental_chunk(s3_client, chunk)
+        except subprocess.CalledProcessError as e:
+            sentry_sdk.capture_exception(e)
+            LOGGER.error(f"Error replaying {chunk}: {e.stderr}")
+            raise
+    LOGGER.info(
+        f"Replayed {len(chunks)} incremental backup(s) "
+        f"({time.monotonic() - start:.1f}s)"
+    )
+
+    start = time.monotonic()
+    try:
+        rebuild_rollups()
+    except subprocess.CalledProcessError as e:
+        sentry_sdk.capture_exception(e)
+        LOGGER.error(f"Error rebuilding rollups: {e.stderr}")
+        raise
+    LOGGER.info(f"Rebuilt rollups ({time.monotonic() - start:.1f}s)")
+
+
+def restore_backup(backup_file: str):
+    """バックアップをリストア"""
+    try:
+        s3_client = get_s3_client()
 
         # データベースに接続してリストアを実行
         LOGGER.info("Starting database restore...")
@@ -304,21 +1038,9 @@ def restore_backup(backup_file: str):
                 capture_output=True,
             )
 
-            # バックアップを復元
-            subprocess.run(
-                [
-                    "psql",
-                    f"--host={DB_HOST}",
-                    f"--dbname={DB_NAME}",
-                    f"--username={DB_USER}",
-                    "-f",
-                    local_file,
-                ],
-                env={"PGPASSWORD": DB_PASSWORD},
-                check=True,
-                capture_output=True,
-                text=True,
-            )
+            # バックアップを展開しながら復元
+            LOGGER.info(f"Streaming backup file: {backup_file}")
+            stream_restore(s3_client, backup_file)
 
             LOGGER.info("Database restore completed successfully")
 
@@ -331,10 +1053,6 @@ def restore_backup(backup_file: str):
         sentry_sdk.capture_exception(e)
         LOGGER.error(f"Restore failed: {str(e)}")
         raise
-    finally:
-        # 一時ファイルを削除
-        if os.path.exists(local_file):
-            os.remove(local_file)
 
 
 def main():
@@ -346,38 +1064,65 @@ def main():
 
     if arg1 == "oneshot":
         LOGGER.info("Running oneshot backup")
-        create_backup()
+        if run_backup():
+            delete_old_backups(get_s3_client())
     elif arg1 == "restore":
         LOGGER.info("Starting restore process")
         backup_file = select_backup_file()
         if backup_file:
+            s3_client = get_s3_client()
+            chunks = list_incremental_chunks(s3_client, backup_file)
+            if chunks:
+                chunks = select_incremental_chunks(chunks)
             restore_backup(backup_file)
+            if chunks:
+                restore_incremental(s3_client, chunks)
         else:
             LOGGER.error("No backup file selected")
+    elif arg1 == "retention":
+        LOGGER.info(f"Applying retention policy: {BACKUP_RETENTION_POLICY}")
+        delete_old_backups(get_s3_client(), dry_run=arg2 == "--dry-run")
     elif arg1 == "test" and arg2 == "--confirm":
-        LOGGER.info("Running test backup")
-        filename = create_backup()
+        LOGGER.info(
+            f"Running test backup (format: {BACKUP_FORMAT}, "
+            f"compression: {BACKUP_COMPRESSION}, jobs: {BACKUP_JOBS})"
+        )
+        start = time.monotonic()
+        # テスト用のバックアップは削除するため、差分バックアップの起点にしない
+        filename = create_backup(update_watermark=False)
+        dump_seconds = time.monotonic() - start
         # リストアを試行
         if filename:
+            start = time.monotonic()
             restore_backup(filename)
+            restore_seconds = time.monotonic() - start
+            LOGGER.info(
+                f"Dump: {dump_seconds:.1f}s, Restore: {restore_seconds:.1f}s "
+                f"({filename})"
+            )
 
         # 削除
         s3_client = get_s3_client()
         s3_client.delete_object(Bucket=S3_BUCKET, Key=filename)
+        s3_client.delete_object(
+            Bucket=S3_BUCKET, Key=f"{filename}{retention.CHECKSUM_SUFFIX}"
+        )
         # 作成したディレクトリも削除
         s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{BACKUP_DIR}/")
 
         LOGGER.info("Test completed")
     else:
-        LOGGER.info(f"Retention period: {BACKUP_RETENTION_DAYS} days")
-        LOGGER.info(f"Scheduled backup time: {BACKUP_TIME}")
-
-        # 指定された時刻にバックアップを実行
-        schedule.every().day.at(BACKUP_TIME).do(create_backup)
-
-        while True:
-            schedule.run_pending()
-            time.sleep(30)
+        LOGGER.info(f"Retention policy: {BACKUP_RETENTION_POLICY}")
+        LOGGER.info(f"Backup mode: {BACKUP_MODE}")
+
+        # バックアップ・保持ポリシーの適用・検証をそれぞれのスケジュールで実行
+        jobs = [
+            Job("backup", BACKUP_CRON, backup_job),
+            Job("retention", RETENTION_CRON, retention_job),
+        ]
+        if VERIFY_CRON:
+            jobs.append(Job("verify", VERIFY_CRON, verify_job))
+        asyncio.run(Scheduler(jobs).run("0.0.0.0", SCHEDULER_STATUS_PORT))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+"""add lookup indexes
+
+Revision ID: c4e1a8f2d6b3
+Revises: bd93cd308d0c
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4e1a8f2d6b3"
+down_revision: Union[str, None] = "bd93cd308d0c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 1ユーザ1行になるよう、重複行は最新（idが最大）のものだけ残す
+    op.execute(
+        "DELETE FROM user_session_storage a USING user_session_storage b "
+        "WHERE a.user_id = b.user_id AND a.id < b.id"
+    )
+    op.execute(
+        "DELETE FROM participants a USING participants b "
+        "WHERE a.discord_user_id = b.discord_user_id AND a.id < b.id"
+    )
+
+    op.create_index(
+        op.f("ix_user_session_storage_user_id"),
+        "user_session_storage",
+        ["user_id"],
+        unique=True,
+    )
+    op.create_index(
+        op.f("ix_participants_discord_user_id"),
+        "participants",
+        ["discord_user_id"],
+        unique=True,
+    )
+    op.create_index(
+        "ix_voice_chat_logs_channel_id_start_time",
+        "voice_chat_logs",
+        ["channel_id", "start_time"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_text_chat_logs_team_id"),
+        "text_chat_logs",
+        ["team_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_text_chat_logs_team_id"), table_name="text_chat_logs")
+    op.drop_index(
+        "ix_voice_chat_logs_channel_id_start_time", table_name="voice_chat_logs"
+    )
+    op.drop_index(op.f("ix_participants_discord_user_id"), table_name="participants")
+    op.drop_index(
+        op.f("ix_user_session_storage_user_id"), table_name="user_session_storage"
+    )
@@ -0,0 +1,39 @@
+"""add log updated_at indexes
+
+Revision ID: 9f3b6d2a7c18
+Revises: e2b7c9d41f85
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9f3b6d2a7c18"
+down_revision: Union[str, None] = "e2b7c9d41f85"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 差分バックアップで前回以降に更新された行を取り出すため
+    op.create_index(
+        op.f("ix_text_chat_logs_updated_at"),
+        "text_chat_logs",
+        ["updated_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_voice_chat_logs_updated_at"),
+        "voice_chat_logs",
+        ["updated_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_voice_chat_logs_updated_at"), table_name="voice_chat_logs")
+    op.drop_index(op.f("ix_text_chat_logs_updated_at"), table_name="text_chat_logs")
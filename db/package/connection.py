@@ -1,8 +1,12 @@
 import os
+import threading
+import time
 
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 
 def get_env(key: str, default: str) -> str:
@@ -17,7 +21,90 @@ SQLALCHEMY_DATABASE_URL = (
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@db:5432/main"
 )
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# connection pool
+DB_POOL_SIZE = int(get_env("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(get_env("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(get_env("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(get_env("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = get_env("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """接続取得の待ち時間を記録するQueuePool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkout_count = 0
+        self.checkout_timeouts = 0
+        # タイムアウト以外の接続失敗（DB停止・認証エラー等）
+        self.checkout_errors = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        except Exception:
+            with self._stats_lock:
+                self.checkout_errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkout_count += 1
+                self.total_wait_seconds += elapsed
+                self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+
+    def recreate(self):
+        # pre-ping失敗時などに再生成されても計測を引き継ぐ
+        pool = super().recreate()
+        pool.checkout_count = self.checkout_count
+        pool.checkout_timeouts = self.checkout_timeouts
+        pool.checkout_errors = self.checkout_errors
+        pool.total_wait_seconds = self.total_wait_seconds
+        pool.max_wait_seconds = self.max_wait_seconds
+        return pool
+
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+def get_pool_stats() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "timeout": DB_POOL_TIMEOUT,
+        "recycle": DB_POOL_RECYCLE,
+        "pre_ping": DB_POOL_PRE_PING,
+        "checkout_count": pool.checkout_count,
+        "checkout_timeouts": pool.checkout_timeouts,
+        "checkout_errors": pool.checkout_errors,
+        "total_wait_seconds": pool.total_wait_seconds,
+        "max_wait_seconds": pool.max_wait_seconds,
+        "avg_wait_seconds": (
+            pool.total_wait_seconds / pool.checkout_count
+            if pool.checkout_count
+            else 0.0
+        ),
+    }
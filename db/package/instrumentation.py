@@ -0,0 +1,72 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from sqlalchemy import event
+
+from .connection import engine
+
+
+class StatementCounter:
+    """実行されたSQLステートメントを記録する"""
+
+    def __init__(self):
+        self.statements: list[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+# run_dbはcontextvarsをスレッドに引き継ぐため、呼び出し元で設定したカウンタに記録される
+_counter: contextvars.ContextVar[StatementCounter | None] = contextvars.ContextVar(
+    "statement_counter", default=None
+)
+
+
+# observer(statement, 経過秒数): 実行されたステートメントの通知先（メトリクス等）
+_query_observers: list[Callable[[str, float], None]] = []
+
+
+def add_query_observer(observer: Callable[[str, float], None]):
+    _query_observers.append(observer)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _counter.get()
+    if counter is not None:
+        counter.statements.append(statement)
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    for observer in _query_observers:
+        observer(statement, elapsed)
+
+
+@event.listens_for(engine, "handle_error")
+def _discard_start_time(context):
+    # 失敗したステートメントはafter_cursor_executeが呼ばれないため、開始時刻を捨てる
+    conn = context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+@contextmanager
+def count_statements():
+    """ブロック内で実行されたステートメントを数える
+
+        with count_statements() as counter:
+            ...
+        counter.count
+    """
+    counter = StatementCounter()
+    token = _counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _counter.reset(token)
@@ -1,6 +1,17 @@
 from datetime import datetime
 
-from sqlalchemy import Integer, DateTime, ForeignKey, String, JSON, BigInteger, Boolean
+from sqlalchemy import (
+    Integer,
+    DateTime,
+    ForeignKey,
+    String,
+    JSON,
+    BigInteger,
+    Boolean,
+    Float,
+    Index,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import text, true as sql_true, false as sql_false
 
@@ -12,7 +23,7 @@ class UserSessionStorage(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
-    user_id: Mapped[int] = mapped_column(BigInteger)
+    user_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
 
     data: Mapped[dict] = mapped_column(JSON, nullable=True)
 
@@ -66,7 +77,9 @@ class Participant(Base):
 
     github_user_name: Mapped[str] = mapped_column(String(255), nullable=False)
 
-    discord_user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    discord_user_id: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, unique=True, index=True
+    )
 
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=text("now()")
@@ -79,11 +92,16 @@ class Participant(Base):
 
 class VoiceChatLog(Base):
     __tablename__ = "voice_chat_logs"
+    __table_args__ = (
+        Index("ix_voice_chat_logs_channel_id_start_time", "channel_id", "start_time"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
     channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
 
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+
     team_id: Mapped[str] = mapped_column(String(255), nullable=False)
 
     start_time: Mapped[datetime] = mapped_column(
@@ -97,7 +115,10 @@ class VoiceChatLog(Base):
     )
 
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), server_default=text("now()"), onupdate=text("now()")
+        DateTime(timezone=True),
+        server_default=text("now()"),
+        onupdate=text("now()"),
+        index=True,
     )
 
 
@@ -106,7 +127,7 @@ class TextChatLog(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
-    team_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    team_id: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
 
     channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     message_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
@@ -115,6 +136,37 @@ class TextChatLog(Base):
         DateTime(timezone=True), server_default=text("now()")
     )
 
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=text("now()"),
+        onupdate=text("now()"),
+        index=True,
+    )
+
+
+class TeamActivityHourly(Base):
+    __tablename__ = "team_activity_hourly"
+    __table_args__ = (UniqueConstraint("team_id", "hour"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    team_id: Mapped[str] = mapped_column(String(255), nullable=False)
+
+    # 集計対象の時間帯の開始時刻（UTCで時単位に切り捨て）
+    hour: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    message_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default=text("0")
+    )
+
+    voice_seconds: Mapped[float] = mapped_column(
+        Float, nullable=False, server_default=text("0")
+    )
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=text("now()")
+    )
+
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=text("now()"), onupdate=text("now()")
     )
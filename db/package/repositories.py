@@ -0,0 +1,294 @@
+"""参加者・グループ・入力セッションのクエリ
+
+各関数は1つの処理につきなるべく1ステートメントで完結するようにし、
+関連オブジェクトはJOINで同時に読み込む（遅延ロードによるN+1を避ける）。
+"""
+
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean,
+    Integer,
+    String,
+    cast,
+    column,
+    delete,
+    exists,
+    func,
+    literal_column,
+    null,
+    select,
+    text,
+    union_all,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+
+from .models import Group, Participant, UserSessionStorage, VoiceChatLog
+
+# INSERT ... ON CONFLICT DO UPDATEのRETURNINGで新規挿入かどうかを返す列
+# （新規挿入された行はxmaxが0、更新された行は更新したトランザクションのIDになる）
+CREATED = literal_column("xmax = 0")
+
+
+# 参加者
+def get_participant(db, discord_user_id: int) -> Participant | None:
+    return db.execute(
+        select(Participant).where(Participant.discord_user_id == discord_user_id)
+    ).scalar()
+
+
+def list_participants_with_group(db) -> list[Participant]:
+    """参加者をグループとともに取得する"""
+    return (
+        db.execute(select(Participant).options(
+                joinedload(Participant.group, innerjoin=True)
+            ))
+        .scalars()
+        .all()
+    )
+
+
+def list_participant_discord_user_ids(db) -> list[int]:
+    return db.execute(select(Participant.discord_user_id)).scalars().all()
+
+
+def upsert_participant(db, discord_user_id: int, **values) -> bool:
+    """discord_user_idをキーに参加者を登録・更新し、新規作成の場合はTrueを返す"""
+    stmt = insert(Participant).values(discord_user_id=discord_user_id, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Participant.discord_user_id],
+        set_={
+            **{key: stmt.excluded[key] for key in values},
+            "updated_at": func.now(),
+        },
+    ).returning(CREATED.label("created"))
+    return db.execute(stmt).scalar_one()
+
+
+# グループ
+def get_group(db, group_id: int) -> Group | None:
+    return db.get(Group, group_id)
+
+
+def list_active_groups(db) -> list[Group]:
+    return (
+        db.execute(
+            select(Group).where(Group.is_disabled.is_(False)).order_by(Group.id)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def upsert_groups(db, rows: list[dict]) -> tuple[list[bool], list[dict]]:
+    """グループを1ステートメントでまとめて登録・更新する
+
+    rowsはline, id, name, short_name, is_disabledを持つdict（idがNoneの行は新規作成）。
+    存在しないidを含む場合は何も書き込まず、その行を返す。
+    (各行が新規作成かどうか, 存在しないidの行)を返す。
+    """
+    data = values(
+        column("line", Integer),
+        column("id", Integer),
+        column("name", String),
+        column("short_name", String),
+        column("is_disabled", Boolean),
+        name="data",
+    ).data(
+        [
+            (row["line"], row["id"], row["name"], row["short_name"], row["is_disabled"])
+            for row in rows
+        ]
+    )
+    # すべてNULLの列も型が決まるようにキャストする
+    input_rows = select(
+        *(cast(data.c[c.name], c.type).label(c.name) for c in data.columns)
+    ).cte("input_rows")
+
+    unknown = (
+        select(input_rows.c.line, input_rows.c.id)
+        .where(
+            input_rows.c.id.is_not(None),
+            ~exists().where(Group.id == input_rows.c.id),
+        )
+        .cte("unknown")
+    )
+
+    # 存在しないidが1件でもあれば挿入・更新しない。idのない行はシーケンスから採番する
+    next_id = func.nextval(func.pg_get_serial_sequence(Group.__tablename__, "id"))
+    stmt = insert(Group).from_select(
+        ["id", "name", "short_name", "is_disabled"],
+        select(
+            func.coalesce(input_rows.c.id, next_id),
+            input_rows.c.name,
+            input_rows.c.short_name,
+            input_rows.c.is_disabled,
+        ).where(~exists(select(unknown.c.id))),
+    )
+    upserted = (
+        stmt.on_conflict_do_update(
+            index_elements=[Group.id],
+            set_={
+                "name": stmt.excluded.name,
+                "short_name": stmt.excluded.short_name,
+                "is_disabled": stmt.excluded.is_disabled,
+                "updated_at": func.now(),
+            },
+        )
+        .returning(CREATED.label("created"))
+        .cte("upserted")
+    )
+
+    result = db.execute(
+        union_all(
+            select(null().label("line"), null().label("id"), upserted.c.created),
+            select(unknown.c.line, unknown.c.id, null()),
+        )
+    ).all()
+    created = [row.created for row in result if row.line is None]
+    unknown_rows = [
+        {"line": row.line, "id": row.id} for row in result if row.line is not None
+    ]
+    return created, unknown_rows
+
+
+# 入力セッション
+def get_session(
+    db, user_id: int, updated_since: datetime | None = None
+) -> UserSessionStorage | None:
+    """セッションを取得する（updated_sinceより前に更新されたものは期限切れとして扱う）"""
+    stmt = select(UserSessionStorage).where(UserSessionStorage.user_id == user_id)
+    if updated_since is not None:
+        stmt = stmt.where(UserSessionStorage.updated_at >= updated_since)
+    return db.execute(stmt).scalar()
+
+
+def delete_session(db, user_id: int):
+    db.execute(
+        delete(UserSessionStorage).where(UserSessionStorage.user_id == user_id)
+    )
+
+
+def delete_sessions_before(db, before: datetime) -> int:
+    """期限切れのセッションを削除し、削除件数を返す"""
+    return db.execute(
+        delete(UserSessionStorage).where(UserSessionStorage.updated_at < before)
+    ).rowcount
+
+
+def save_session_data(db, user_id: int, data: dict):
+    """セッションのデータを置き換える（存在しない場合は作成する）"""
+    stmt = insert(UserSessionStorage).values(user_id=user_id, data=data)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserSessionStorage.user_id],
+        set_={"data": stmt.excluded.data, "updated_at": func.now()},
+    )
+    db.execute(stmt)
+
+
+# ボイスチャットログ
+def reconcile_voice_logs(
+    db, current: dict[tuple[int, int], str], now: datetime
+) -> dict[tuple[int, int], int]:
+    """未終了のログを現在ボイスチャンネルにいるメンバーと突き合わせる
+
+    current: (member_id, channel_id) -> team_id
+    一致したログは開いたままにし、参加中でログのないメンバーは新しくログを開く。
+    (member_id, channel_id) -> 開いているログのIDを返す。
+    """
+    sessions = {}
+    open_logs = (
+        db.execute(select(VoiceChatLog).where(VoiceChatLog.end_time.is_(None)))
+        .scalars()
+        .all()
+    )
+    for log in open_logs:
+        key = (log.user_id, log.channel_id)
+        if log.user_id is not None and key in current and key not in sessions:
+            sessions[key] = log.id
+        else:
+            # 停止中に退出したログや、以前の退出処理で閉じられなかったログは
+            # 退出時刻が分からないため、通話時間0で閉じる（ロールアップにも加算しない）
+            log.end_time = log.start_time
+
+    # ログのない参加中メンバーは新しくセッションを開く
+    new_logs = {
+        key: VoiceChatLog(
+            user_id=key[0],
+            channel_id=key[1],
+            team_id=team_id,
+            start_time=now,
+            end_time=None,
+        )
+        for key, team_id in current.items()
+        if key not in sessions
+    }
+    db.add_all(new_logs.values())
+    db.commit()
+
+    for key, log in new_logs.items():
+        sessions[key] = log.id
+    return sessions
+
+
+# 参加者の一括取り込み
+PARTICIPANT_IMPORT_COLUMNS = [
+    "last_name",
+    "first_name",
+    "group_id",
+    "github_user_name",
+    "discord_user_id",
+]
+
+
+def import_participants(db, rows: list[tuple]) -> tuple[int, int, list[int]]:
+    """参加者をCOPYで一時テーブルに読み込み、1つのINSERT ... ON CONFLICTで反映する
+
+    rowsはPARTICIPANT_IMPORT_COLUMNSの順のタプル（discord_user_idは重複なし）。
+    (新規作成数, 更新数, 存在しないグループのため取り込めなかったdiscord_user_id)を返す。
+    """
+    columns = ", ".join(PARTICIPANT_IMPORT_COLUMNS)
+
+    db.execute(
+        text(
+            "CREATE TEMP TABLE participants_import ("
+            "last_name text, first_name text, group_id integer, "
+            "github_user_name text, discord_user_id bigint"
+            ") ON COMMIT DROP"
+        )
+    )
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY participants_import ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+    # グループが存在する行のみを反映する
+    result = db.execute(
+        text(
+            f"INSERT INTO participants ({columns}) "
+            f"SELECT {', '.join(f'i.{c}' for c in PARTICIPANT_IMPORT_COLUMNS)} "
+            "FROM participants_import i JOIN groups g ON g.id = i.group_id "
+            "ON CONFLICT (discord_user_id) DO UPDATE SET "
+            "last_name = excluded.last_name, first_name = excluded.first_name, "
+            "group_id = excluded.group_id, "
+            "github_user_name = excluded.github_user_name, updated_at = now() "
+            "RETURNING discord_user_id, xmax = 0"
+        )
+    ).all()
+    db.commit()
+
+    imported = {discord_user_id for discord_user_id, _ in result}
+    inserted = sum(1 for _, created in result if created)
+    rejected = [row[4] for row in rows if row[4] not in imported]
+    return inserted, len(result) - inserted, rejected
@@ -0,0 +1,36 @@
+"""ロールアップを生ログから再構築するSQL
+
+バックアップ用のコンテナ（SQLAlchemyを含まない）からもpsqlで実行するため、
+SQLの文字列のみを定義する。
+"""
+
+REBUILD_SQL = [
+    "LOCK TABLE team_activity_hourly IN EXCLUSIVE MODE",
+    "DELETE FROM team_activity_hourly",
+    """
+    INSERT INTO team_activity_hourly (team_id, hour, message_count)
+    SELECT team_id,
+           date_trunc('hour', created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+           count(*)
+    FROM text_chat_logs
+    GROUP BY 1, 2
+    """,
+    """
+    INSERT INTO team_activity_hourly (team_id, hour, voice_seconds)
+    SELECT v.team_id,
+           h.hour,
+           sum(extract(epoch FROM
+               least(v.end_time, h.hour + interval '1 hour')
+               - greatest(v.start_time, h.hour)))
+    FROM voice_chat_logs v
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('hour', v.start_time AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+        v.end_time,
+        interval '1 hour'
+    ) AS h(hour)
+    WHERE v.end_time IS NOT NULL AND v.end_time > v.start_time AND h.hour < v.end_time
+    GROUP BY 1, 2
+    ON CONFLICT (team_id, hour)
+    DO UPDATE SET voice_seconds = EXCLUDED.voice_seconds
+    """,
+]
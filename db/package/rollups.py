@@ -0,0 +1,90 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import TeamActivityHourly
+from .rollup_sql import REBUILD_SQL
+
+
+def floor_hour(dt: datetime) -> datetime:
+    """UTCの時単位に切り捨てる（タイムゾーン未指定はUTCとみなす）"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def split_by_hour(start: datetime, end: datetime) -> list[tuple[datetime, float]]:
+    """[start, end)を時単位に分割し、各時間帯の秒数を返す"""
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+
+    result = []
+    hour = floor_hour(start)
+    while hour < end:
+        next_hour = hour + timedelta(hours=1)
+        seconds = (min(end, next_hour) - max(start, hour)).total_seconds()
+        if seconds > 0:
+            result.append((hour, seconds))
+        hour = next_hour
+    return result
+
+
+def upsert_activity(db, activity: dict[tuple[str, datetime], tuple[int, float]]):
+    """(team_id, hour) -> (メッセージ数, 通話秒数)をロールアップに加算する"""
+    if not activity:
+        return
+
+    stmt = insert(TeamActivityHourly).values(
+        [
+            {
+                "team_id": team_id,
+                "hour": hour,
+                "message_count": message_count,
+                "voice_seconds": voice_seconds,
+            }
+            for (team_id, hour), (message_count, voice_seconds) in activity.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TeamActivityHourly.team_id, TeamActivityHourly.hour],
+        set_={
+            "message_count": TeamActivityHourly.message_count
+            + stmt.excluded.message_count,
+            "voice_seconds": TeamActivityHourly.voice_seconds
+            + stmt.excluded.voice_seconds,
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def add_text_messages(db, rows: list[dict]):
+    """テキストチャットログの行（team_id, created_at）をロールアップに加算する"""
+    counts = defaultdict(int)
+    for row in rows:
+        counts[(row["team_id"], floor_hour(row["created_at"]))] += 1
+    upsert_activity(db, {key: (count, 0.0) for key, count in counts.items()})
+
+
+def add_voice_sessions(db, sessions: list[tuple[str, datetime, datetime]]):
+    """終了したボイスセッション（team_id, start, end）をロールアップに加算する"""
+    seconds = defaultdict(float)
+    for team_id, start, end in sessions:
+        for hour, s in split_by_hour(start, end):
+            seconds[(team_id, hour)] += s
+    upsert_activity(db, {key: (0, s) for key, s in seconds.items()})
+
+
+def rebuild(db) -> int:
+    """生ログからロールアップを再構築する（バックフィル）"""
+    for sql in REBUILD_SQL:
+        db.execute(text(sql))
+    count = db.execute(
+        text("SELECT count(*) FROM team_activity_hourly")
+    ).scalar_one()
+    db.commit()
+    return count
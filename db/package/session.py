@@ -1,6 +1,15 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import partial
 
-from .connection import SessionLocal
+from .connection import SessionLocal, get_env
+
+# 同期セッションを実行するスレッド数（イベントループをブロックしないための上限）
+DB_EXECUTOR_WORKERS = int(get_env("DB_EXECUTOR_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
 
 
 def db_context():
@@ -12,3 +21,18 @@ def db_context():
 
 
 get_db = contextmanager(db_context)
+
+
+def _call_with_db(func, *args, **kwargs):
+    with get_db() as db:
+        return func(db, *args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """セッションを開き、func(db, *args, **kwargs)をDB用スレッドプールで実行する"""
+    loop = asyncio.get_running_loop()
+    # contextvarsを引き継いでスレッド側でも計測等を参照できるようにする
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _executor, partial(ctx.run, _call_with_db, func, *args, **kwargs)
+    )
@@ -0,0 +1,229 @@
+"""バックアップの保持ポリシーの適用
+
+バックアップディレクトリを1回だけ一覧取得し、ポリシーから外れたバックアップ
+（と、それに続く差分バックアップ）を1,000件ずつ並列に削除する。
+フルバックアップと差分バックアップのそれぞれを復元できる時点として扱い、
+保持する時点の差分バックアップが続くフルバックアップは残す。
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# delete_objectsで1回に削除できるキーの上限
+DELETE_BATCH_SIZE = 1000
+# バックアップのSHA-256を保存するオブジェクトの接尾辞（<キー>.sha256）
+CHECKSUM_SUFFIX = ".sha256"
+
+# 保持の単位ごとに、同じ期間として扱うバックアップをまとめるキー
+TIERS: Dict[str, Callable[[datetime], tuple]] = {
+    "daily": lambda dt: (dt.year, dt.month, dt.day),
+    "weekly": lambda dt: tuple(dt.isocalendar()[:2]),
+    "monthly": lambda dt: (dt.year, dt.month),
+}
+
+
+def parse_policy(text: str) -> List[Tuple[str, int]]:
+    """"daily:30,weekly:365" 形式の保持ポリシーを解釈する"""
+    policy = []
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        tier, _, days = item.strip().partition(":")
+        if tier not in TIERS or not days.isdigit():
+            raise ValueError(f"Invalid retention policy: {item.strip()}")
+        policy.append((tier, int(days)))
+    if not policy:
+        raise ValueError("Retention policy is empty")
+    return policy
+
+
+def parse_backup_time(key: str) -> Optional[datetime]:
+    """backup_YYYYMMDD_HHMMSS.<拡張子> からバックアップの作成日時を取得"""
+    name = os.path.basename(key)
+    if not name.startswith("backup_"):
+        return None
+    try:
+        return datetime.strptime(name[len("backup_") :][:15], "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+
+def list_keys(s3_client, bucket: str, prefix: str) -> List[str]:
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def select_kept(
+    backups: Dict[str, datetime], policy: List[Tuple[str, int]], now: datetime
+) -> set:
+    """ポリシーの各単位について、保持期間内の期間ごとに最新のバックアップを残す"""
+    kept = set()
+    newest_first = sorted(backups.items(), key=lambda item: item[1], reverse=True)
+    for tier, days in policy:
+        cutoff = now - timedelta(days=days)
+        seen = set()
+        for key, created_at in newest_first:
+            if created_at < cutoff:
+                break
+            period = TIERS[tier](created_at)
+            if period not in seen:
+                seen.add(period)
+                kept.add(key)
+    return kept
+
+
+class RetentionResult:
+    def __init__(self):
+        self.kept: List[str] = []
+        self.expired: List[str] = []
+        self.deleted = 0
+        # (キー, エラーコード, メッセージ)
+        self.errors: List[Tuple[str, str, str]] = []
+
+    def summary(self) -> str:
+        return (
+            f"kept {len(self.kept)} backup(s), expired {len(self.expired)} key(s), "
+            f"deleted {self.deleted}, failed {len(self.errors)}"
+        )
+
+
+def parse_chunk_time(key: str) -> Optional[datetime]:
+    """差分バックアップ YYYYMMDD_HHMMSS_<テーブル名>.csv.gz の作成日時を取得"""
+    try:
+        return datetime.strptime(os.path.basename(key)[:15], "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+
+def plan_retention(
+    keys: List[str],
+    backup_dir: str,
+    policy: List[Tuple[str, int]],
+    now: datetime,
+    result: RetentionResult,
+    protected: Optional[str] = None,
+):
+    """一覧取得したキーから削除対象を決める
+
+    protectedには差分バックアップの起点になっているフルバックアップを指定し、
+    ポリシーに関わらず残す。
+    """
+    full_prefix = f"{backup_dir}/backup_"
+    incremental_prefix = f"{backup_dir}/incremental/"
+
+    backups = {}
+    checksums = []
+    for key in keys:
+        if not key.startswith(full_prefix):
+            continue
+        if key.endswith(CHECKSUM_SUFFIX):
+            checksums.append(key)
+            continue
+        created_at = parse_backup_time(key)
+        if created_at is None:
+            LOGGER.warning(f"Could not parse date from filename: {key}")
+            continue
+        backups[key] = created_at
+
+    # 差分バックアップを、続く元のフルバックアップごとの復元できる時点にまとめる
+    names = {os.path.basename(key).split(".")[0]: key for key in backups}
+    chunks: Dict[str, List[str]] = {}
+    points = dict(backups)
+    point_backups = {key: key for key in backups}
+    for key in keys:
+        if not key.startswith(incremental_prefix):
+            continue
+        name, _, rest = key[len(incremental_prefix) :].partition("/")
+        if not rest or parse_backup_time(name) is None:
+            continue
+        chunks.setdefault(name, []).append(key)
+        created_at = parse_chunk_time(rest)
+        if name in names and created_at is not None:
+            point = f"{incremental_prefix}{name}/{rest[:15]}"
+            points[point] = created_at
+            point_backups[point] = names[name]
+
+    kept = {point_backups[point] for point in select_kept(points, policy, now)}
+    if protected in backups:
+        kept.add(protected)
+    result.kept = sorted(kept, reverse=True)
+    result.expired = sorted(key for key in backups if key not in kept)
+    # チェックサムはバックアップと一緒に削除する
+    result.expired.extend(
+        key for key in checksums if key.removesuffix(CHECKSUM_SUFFIX) not in kept
+    )
+
+    # 差分バックアップは、元のフルバックアップが残っていない場合に削除する
+    kept_names = {os.path.basename(key).split(".")[0] for key in kept}
+    for name, chunk_keys in chunks.items():
+        if name not in kept_names:
+            result.expired.extend(chunk_keys)
+
+
+def load_protected(s3_client, bucket: str, backup_dir: str, keys: List[str]):
+    """差分バックアップの起点になっているフルバックアップを取得"""
+    watermark_key = f"{backup_dir}/incremental/watermark.json"
+    if watermark_key not in keys:
+        return None
+    body = s3_client.get_object(Bucket=bucket, Key=watermark_key)["Body"]
+    return json.loads(body.read()).get("full_backup")
+
+
+def delete_keys(
+    s3_client, bucket: str, keys: List[str], concurrency: int, result: RetentionResult
+):
+    """1,000件ずつ並列に削除し、キーごとのエラーをresultに記録する"""
+    batches = [
+        keys[i : i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)
+    ]
+
+    def delete_batch(batch: List[str]):
+        try:
+            response = s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+        except Exception as e:
+            # バッチ全体が失敗した場合は全キーを失敗として扱う
+            return [(key, type(e).__name__, str(e)) for key in batch]
+        return [
+            (error["Key"], error.get("Code", ""), error.get("Message", ""))
+            for error in response.get("Errors", [])
+        ]
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        for batch, errors in zip(batches, executor.map(delete_batch, batches)):
+            result.deleted += len(batch) - len(errors)
+            result.errors.extend(errors)
+
+
+def apply_retention(
+    s3_client,
+    bucket: str,
+    backup_dir: str,
+    policy: List[Tuple[str, int]],
+    now: Optional[datetime] = None,
+    concurrency: int = 4,
+    dry_run: bool = False,
+) -> RetentionResult:
+    result = RetentionResult()
+    keys = list_keys(s3_client, bucket, f"{backup_dir}/")
+    protected = load_protected(s3_client, bucket, backup_dir, keys)
+    plan_retention(
+        keys, backup_dir, policy, now or datetime.now(), result, protected=protected
+    )
+
+    if result.expired and not dry_run:
+        delete_keys(s3_client, bucket, result.expired, concurrency, result)
+    for key, code, message in result.errors:
+        LOGGER.error(f"Error deleting {key}: {code} {message}")
+    return result
@@ -0,0 +1,205 @@
+"""cron形式で同期関数を定期実行するasyncioのスケジューラ
+
+ジョブはスレッドで実行するため、長時間のバックアップ中も他のジョブや
+ステータスの応答は止まらない。同じジョブの実行中に次の時刻が来た場合は
+重複して実行せずスキップする。
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+import sentry_sdk
+
+LOGGER = logging.getLogger(__name__)
+
+# (最小値, 最大値) 分, 時, 日, 月, 曜日（0, 7が日曜）
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(field: str, minimum: int, maximum: int) -> set:
+    values = set()
+    for part in field.split(","):
+        base, _, step = part.partition("/")
+        if base == "*":
+            start, end = minimum, maximum
+        elif "-" in base:
+            start, end = (int(v) for v in base.split("-", 1))
+        else:
+            start = end = int(base)
+        if step:
+            if not base.startswith("*") and "-" not in base:
+                # "5/15" は 5-最大値/15 とみなす
+                end = maximum
+            step = int(step)
+        else:
+            step = 1
+        if start < minimum or end > maximum or start > end or step < 1:
+            raise ValueError(f"Invalid cron field: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """「分 時 日 月 曜日」の5フィールドのcron式"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, *bounds) for field, bounds in zip(fields, CRON_FIELDS)
+        )
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # 日と曜日の両方が指定された場合は、どちらかに一致すれば実行する（cronと同じ）
+        self._days_restricted = not fields[2].startswith("*")
+        self._weekdays_restricted = not fields[4].startswith("*")
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day = dt.day in self.days
+        # datetime.weekday()は月曜が0、cronは日曜が0
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return day or weekday
+        if self._days_restricted:
+            return day
+        if self._weekdays_restricted:
+            return weekday
+        return True
+
+    def next_after(self, dt: datetime) -> datetime:
+        """dtより後で最初に一致する時刻"""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t.year + 5
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+
+class Job:
+    def __init__(self, name: str, cron: str, func: Callable[[], Optional[dict]]):
+        self.name = name
+        self.cron = CronExpression(cron)
+        # 結果（サイズ等）をdictで返す同期関数
+        self.func = func
+        self.lock = asyncio.Lock()
+
+        self.next_run_at: Optional[datetime] = None
+        self.last_started_at: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_status: Optional[str] = None
+        self.last_result: Optional[dict] = None
+        self.last_error: Optional[str] = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+
+    async def run(self):
+        async with self.lock:
+            self.last_started_at = datetime.now()
+            start = time.monotonic()
+            LOGGER.info(f"Job {self.name} started")
+            try:
+                self.last_result = await asyncio.to_thread(self.func)
+                self.last_status = "success"
+                self.last_error = None
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                LOGGER.error(f"Job {self.name} failed: {str(e)}")
+                self.last_status = "failed"
+                self.last_error = str(e)
+                self.failures += 1
+            finally:
+                self.last_duration = time.monotonic() - start
+                self.runs += 1
+            LOGGER.info(
+                f"Job {self.name} finished: {self.last_status} "
+                f"({self.last_duration:.1f}s)"
+            )
+
+    def status(self) -> dict:
+        def isoformat(dt):
+            return dt.isoformat() if dt is not None else None
+
+        return {
+            "name": self.name,
+            "cron": self.cron.expression,
+            "running": self.lock.locked(),
+            "next_run_at": isoformat(self.next_run_at),
+            "last_started_at": isoformat(self.last_started_at),
+            "last_duration": self.last_duration,
+            "last_status": self.last_status,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+        }
+
+
+class Scheduler:
+    def __init__(self, jobs: List[Job]):
+        self.jobs = jobs
+        self._tasks: set = set()
+
+    async def _schedule(self, job: Job):
+        job.next_run_at = job.cron.next_after(datetime.now())
+        while True:
+            scheduled_at = job.next_run_at
+            delay = (scheduled_at - datetime.now()).total_seconds()
+            await asyncio.sleep(max(delay, 0))
+            # sleepが予定時刻より僅かに早く戻っても同じ時刻を再度実行しないよう、
+            # 次の時刻は今回の予定時刻から計算する（大きく遅れた場合は過ぎた時刻を飛ばす）
+            job.next_run_at = job.cron.next_after(max(scheduled_at, datetime.now()))
+
+            if job.lock.locked():
+                job.skipped += 1
+                LOGGER.warning(f"Job {job.name} is still running; skipped this run")
+                continue
+            # 実行の完了は待たない（ロックで重複は防ぐ）
+            task = asyncio.create_task(job.run())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle_status(self, reader, writer):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            body = json.dumps({"jobs": [job.status() for job in self.jobs]}).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, status_host: str, status_port: int):
+        """ジョブのスケジュールとステータス用のHTTPサーバを開始する"""
+        server = await asyncio.start_server(
+            self._handle_status, status_host, status_port
+        )
+        LOGGER.info(f"Scheduler status server started on port {status_port}")
+        for job in self.jobs:
+            LOGGER.info(f"Scheduled job {job.name}: {job.cron.expression}")
+
+        async with server:
+            await asyncio.gather(*(self._schedule(job) for job in self.jobs))
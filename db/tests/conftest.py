@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# db/をimportのルートにする（マイグレーション等と同じく `package.` で参照する）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def db_engine():
+    """接続できるDBのエンジン（compose外などDBがない環境ではスキップ）"""
+    from sqlalchemy.exc import OperationalError
+
+    from package.connection import engine
+
+    try:
+        with engine.connect():
+            pass
+    except OperationalError:
+        pytest.skip("database is not available")
+    return engine
+
+
+@pytest.fixture
+def db(db_engine):
+    """テストの最後にロールバックするトランザクション内のセッション"""
+    from sqlalchemy.orm import Session
+
+    with db_engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            with Session(bind=conn) as session:
+                yield session
+        finally:
+            transaction.rollback()
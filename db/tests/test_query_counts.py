@@ -0,0 +1,137 @@
+"""参加者情報入力フローのSQLステートメント数の回帰テスト
+
+各フローを実際のDBに対してトランザクション内で実行し（最後にロールバックする）、
+実行されたステートメント数が想定どおりであることを確認する。
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import insert
+
+from package import repositories
+from package.instrumentation import count_statements
+from package.models import Group
+
+# 検証用のDiscordユーザーID（実在しない値）
+USER_ID = 999999999999999999
+
+
+@pytest.fixture
+def group_id(db) -> int:
+    return db.execute(
+        insert(Group)
+        .values(name="query count check", short_name="qcc")
+        .returning(Group.id)
+    ).scalar_one()
+
+
+def _assert_statements(counter, expected: int):
+    statements = "\n".join(" ".join(s.split()) for s in counter.statements)
+    assert counter.count == expected, statements
+
+
+def _confirm(db, group_id: int) -> bool:
+    """ParticipantInfoConfirmButton: 登録（入力途中の状態はDB外に保持する）"""
+    return repositories.upsert_participant(
+        db,
+        USER_ID,
+        last_name="関西",
+        first_name="太郎",
+        github_user_name="example",
+        group_id=group_id,
+    )
+
+
+def test_confirm_creates_participant_in_one_statement(db, group_id):
+    with count_statements() as counter:
+        assert _confirm(db, group_id)
+    _assert_statements(counter, 1)
+
+
+def test_confirm_again_updates_participant_in_one_statement(db, group_id):
+    _confirm(db, group_id)
+    with count_statements() as counter:
+        assert not _confirm(db, group_id)
+    _assert_statements(counter, 1)
+
+
+def test_set_nick_loads_groups_without_lazy_loading(db, group_id):
+    _confirm(db, group_id)
+    with count_statements() as counter:
+        participants = repositories.list_participants_with_group(db)
+        assert all(participant.group.short_name for participant in participants)
+    _assert_statements(counter, 1)
+
+
+def test_group_select_cache_load_in_one_statement(db, group_id):
+    """GroupCache: 選択肢の読み込み"""
+    with count_statements() as counter:
+        groups = repositories.list_active_groups(db)
+    assert group_id in {group.id for group in groups}
+    _assert_statements(counter, 1)
+
+
+def test_modal_submit_with_db_store(db):
+    """ParticipantInfoModal: DBStoreへの入力途中の状態の保存（取得と置き換え）"""
+    expires_before = datetime.now(timezone.utc) - timedelta(minutes=30)
+    with count_statements() as counter:
+        user_session = repositories.get_session(db, USER_ID, expires_before)
+        data = {**(user_session.data if user_session else {}), "last_name": "関西"}
+        repositories.save_session_data(db, USER_ID, data)
+    _assert_statements(counter, 2)
+
+    with count_statements() as counter:
+        user_session = repositories.get_session(db, USER_ID, expires_before)
+    assert user_session.data == {"last_name": "関西"}
+    _assert_statements(counter, 1)
+
+
+def test_group_import_in_one_statement(db, group_id):
+    """GroupList: CSVの取り込み（存在しないidの確認と登録・更新を1ステートメントで行う）"""
+    rows = [
+        {
+            "line": 2,
+            "id": group_id,
+            "name": "更新",
+            "short_name": "upd",
+            "is_disabled": False,
+        },
+        {
+            "line": 3,
+            "id": None,
+            "name": "新規",
+            "short_name": "new",
+            "is_disabled": True,
+        },
+    ]
+    with count_statements() as counter:
+        created, unknown = repositories.upsert_groups(db, rows)
+    _assert_statements(counter, 1)
+    assert sorted(created) == [False, True]
+    assert unknown == []
+
+
+def test_group_import_with_unknown_id_writes_nothing(db, group_id):
+    rows = [
+        {
+            "line": 2,
+            "id": group_id,
+            "name": "更新",
+            "short_name": "upd",
+            "is_disabled": False,
+        },
+        {
+            "line": 3,
+            "id": group_id + 1000000,
+            "name": "不明",
+            "short_name": "unk",
+            "is_disabled": False,
+        },
+    ]
+    with count_statements() as counter:
+        created, unknown = repositories.upsert_groups(db, rows)
+    _assert_statements(counter, 1)
+    assert created == []
+    assert unknown == [{"line": 3, "id": group_id + 1000000}]
+    assert repositories.get_group(db, group_id).name == "query count check"
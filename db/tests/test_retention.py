@@ -0,0 +1,159 @@
+import json
+from datetime import datetime, timedelta
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import retention
+
+BUCKET = "backups"
+BACKUP_DIR = "default"
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _put(s3_client, *keys: str):
+    for key in keys:
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"")
+
+
+def _full(day: int) -> str:
+    return f"{BACKUP_DIR}/backup_202610{day:02d}_030000.sql.gz"
+
+
+def _chunks(full_day: int, day: int) -> list[str]:
+    prefix = f"{BACKUP_DIR}/incremental/backup_202610{full_day:02d}_030000"
+    return [
+        f"{prefix}/202610{day:02d}_030000_{table}.csv.gz{suffix}"
+        for table in ("text_chat_logs", "voice_chat_logs")
+        for suffix in ("", retention.CHECKSUM_SUFFIX)
+    ]
+
+
+def _remaining(s3_client) -> set:
+    return set(retention.list_keys(s3_client, BUCKET, f"{BACKUP_DIR}/"))
+
+
+def test_keeps_full_backup_while_its_increments_are_kept(s3_client):
+    """フルバックアップが期間外でも、差分バックアップが期間内なら残す"""
+    chunks = [key for day in range(2, 8) for key in _chunks(1, day)]
+    _put(
+        s3_client,
+        _full(1),
+        _full(1) + retention.CHECKSUM_SUFFIX,
+        _full(8),
+        _full(8) + retention.CHECKSUM_SUFFIX,
+        *chunks,
+    )
+
+    result = retention.apply_retention(
+        s3_client,
+        BUCKET,
+        BACKUP_DIR,
+        retention.parse_policy("daily:7"),
+        now=datetime(2026, 10, 8, 4, 30),
+    )
+
+    assert result.kept == [_full(8), _full(1)]
+    assert result.expired == []
+    assert set(chunks) <= _remaining(s3_client)
+
+
+def test_deletes_full_backup_and_increments_outside_the_policy(s3_client):
+    expired = [_full(1), _full(1) + retention.CHECKSUM_SUFFIX, *_chunks(1, 2)]
+    kept = [_full(8), _full(8) + retention.CHECKSUM_SUFFIX, *_chunks(8, 9)]
+    _put(s3_client, *expired, *kept)
+
+    result = retention.apply_retention(
+        s3_client,
+        BUCKET,
+        BACKUP_DIR,
+        retention.parse_policy("daily:7"),
+        now=datetime(2026, 10, 10, 4, 30),
+    )
+
+    assert result.kept == [_full(8)]
+    assert sorted(result.expired) == sorted(expired)
+    assert result.deleted == len(expired)
+    assert _remaining(s3_client) == set(kept)
+
+
+def test_keeps_full_backup_of_the_watermark(s3_client):
+    """差分バックアップの起点になっているフルバックアップは常に残す"""
+    _put(s3_client, _full(1), _full(1) + retention.CHECKSUM_SUFFIX)
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key=f"{BACKUP_DIR}/incremental/watermark.json",
+        Body=json.dumps(
+            {
+                "full_backup": _full(1),
+                "full_backup_date": "2026-10-01",
+                "watermark": "2026-10-01 03:00:00+09",
+            }
+        ).encode(),
+    )
+
+    result = retention.apply_retention(
+        s3_client,
+        BUCKET,
+        BACKUP_DIR,
+        retention.parse_policy("daily:7"),
+        now=datetime(2026, 10, 20, 4, 30),
+    )
+
+    assert result.kept == [_full(1)]
+    assert result.expired == []
+    assert _full(1) in _remaining(s3_client)
+
+
+def test_deletes_expired_keys_in_batches_of_1000(s3_client, monkeypatch):
+    """2,500件の削除対象を1,000件ずつのdelete_objectsで削除する"""
+    start = datetime(2026, 8, 1)
+    expired = []
+    for i in range(1250):
+        name = (start + timedelta(minutes=i)).strftime("%Y%m%d_%H%M%S")
+        key = f"{BACKUP_DIR}/backup_{name}.sql.gz"
+        expired += [key, key + retention.CHECKSUM_SUFFIX]
+    newest = [_full(day) for day in range(14, 21)]
+    protected = f"{BACKUP_DIR}/backup_20260701_030000.sql.gz"
+    _put(s3_client, *expired, *newest, protected)
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key=f"{BACKUP_DIR}/incremental/watermark.json",
+        Body=json.dumps({"full_backup": protected}).encode(),
+    )
+
+    batch_sizes = []
+    delete_objects = s3_client.delete_objects
+
+    def counting_delete_objects(**kwargs):
+        batch_sizes.append(len(kwargs["Delete"]["Objects"]))
+        return delete_objects(**kwargs)
+
+    monkeypatch.setattr(s3_client, "delete_objects", counting_delete_objects)
+
+    result = retention.apply_retention(
+        s3_client,
+        BUCKET,
+        BACKUP_DIR,
+        retention.parse_policy("daily:7"),
+        now=datetime(2026, 10, 20, 4, 30),
+    )
+
+    assert sorted(batch_sizes) == [500, 1000, 1000]
+    assert result.deleted == 2500
+    assert result.errors == []
+    assert _remaining(s3_client) == {
+        *newest,
+        protected,
+        f"{BACKUP_DIR}/incremental/watermark.json",
+    }
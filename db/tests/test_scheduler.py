@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import scheduler
+from scheduler import Job, Scheduler
+
+
+class _Stop(Exception):
+    pass
+
+
+def test_early_wakeup_does_not_run_the_same_slot_twice(monkeypatch):
+    """sleepが予定時刻より僅かに早く戻っても、次の予定は翌日になる"""
+    clock = [datetime(2026, 10, 17, 3, 59, 30)]
+    wakeups = [datetime(2026, 10, 17, 3, 59, 59, 999000)]
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock[0]
+
+    async def fake_sleep(delay):
+        if not wakeups:
+            raise _Stop
+        clock[0] = wakeups.pop(0)
+
+    monkeypatch.setattr(scheduler, "datetime", FakeDatetime)
+    monkeypatch.setattr(scheduler.asyncio, "sleep", fake_sleep)
+
+    job = Job("backup", "0 4 * * *", lambda: None)
+    runs = []
+
+    async def run():
+        runs.append(clock[0])
+
+    monkeypatch.setattr(job, "run", run)
+
+    async def main():
+        with pytest.raises(_Stop):
+            await Scheduler([job])._schedule(job)
+        await asyncio.gather(*asyncio.all_tasks() - {asyncio.current_task()})
+
+    asyncio.run(main())
+
+    assert runs == [datetime(2026, 10, 17, 3, 59, 59, 999000)]
+    assert job.next_run_at == datetime(2026, 10, 18, 4, 0)
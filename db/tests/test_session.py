@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from package.session import run_db
+
+# 遅いクエリの実行時間と、その間のハートビートの間隔（秒）
+SLOW_SECONDS = 0.5
+HEARTBEAT_INTERVAL = 0.01
+
+
+async def _run_with_heartbeat(func, *args):
+    """run_dbの実行中にハートビートを刻み、結果と最大の間隔を返す"""
+    gaps = []
+
+    async def heartbeat():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    task = asyncio.create_task(heartbeat())
+    try:
+        result = await run_db(func, *args)
+    finally:
+        task.cancel()
+    return result, gaps
+
+
+def _slow_call(db, seconds: float) -> str:
+    time.sleep(seconds)
+    return "done"
+
+
+def _slow_query(db, seconds: float) -> int:
+    db.execute(text("SELECT pg_sleep(:seconds)"), {"seconds": seconds})
+    return 1
+
+
+def _assert_responsive(gaps: list[float]):
+    # ブロックされていればSLOW_SECONDS分の間隔が1回空く
+    assert len(gaps) >= SLOW_SECONDS / HEARTBEAT_INTERVAL / 2
+    assert max(gaps) < SLOW_SECONDS / 5
+
+
+def test_event_loop_keeps_running_during_blocking_call():
+    result, gaps = asyncio.run(_run_with_heartbeat(_slow_call, SLOW_SECONDS))
+    assert result == "done"
+    _assert_responsive(gaps)
+
+
+def test_event_loop_keeps_running_during_slow_query(db_engine):
+    result, gaps = asyncio.run(_run_with_heartbeat(_slow_query, SLOW_SECONDS))
+    assert result == 1
+    _assert_responsive(gaps)
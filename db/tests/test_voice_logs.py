@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from package import repositories
+from package.models import TeamActivityHourly, VoiceChatLog
+
+TEAM_ID = "voice log test"
+CHANNEL_ID = 999999999999999999
+
+
+def _totals(db) -> tuple[float, float]:
+    """(ボイスチャットログの合計秒数, ロールアップの合計秒数)"""
+    log_seconds = db.execute(
+        select(
+            func.coalesce(
+                func.sum(
+                    func.extract(
+                        "epoch", VoiceChatLog.end_time - VoiceChatLog.start_time
+                    )
+                ),
+                0,
+            )
+        ).where(VoiceChatLog.team_id == TEAM_ID, VoiceChatLog.end_time.is_not(None))
+    ).scalar_one()
+    rollup_seconds = db.execute(
+        select(func.coalesce(func.sum(TeamActivityHourly.voice_seconds), 0)).where(
+            TeamActivityHourly.team_id == TEAM_ID
+        )
+    ).scalar_one()
+    return float(log_seconds), float(rollup_seconds)
+
+
+def test_stale_open_logs_are_closed_without_voice_time(db):
+    """退出時刻の分からない未終了ログは、通話時間0で閉じる"""
+    now = datetime.now(timezone.utc)
+    stale = [
+        # 以前の退出処理で閉じられなかったuser_idのないログ
+        VoiceChatLog(
+            user_id=None,
+            channel_id=CHANNEL_ID,
+            team_id=TEAM_ID,
+            start_time=now - timedelta(days=3),
+        ),
+        # 停止中に退出したメンバーのログ
+        VoiceChatLog(
+            user_id=1,
+            channel_id=CHANNEL_ID,
+            team_id=TEAM_ID,
+            start_time=now - timedelta(hours=5),
+        ),
+    ]
+    db.add_all(stale)
+    db.flush()
+    before = _totals(db)
+
+    sessions = repositories.reconcile_voice_logs(db, {(2, CHANNEL_ID): TEAM_ID}, now)
+
+    for log in stale:
+        db.refresh(log)
+        assert log.end_time == log.start_time
+    assert set(sessions) == {(2, CHANNEL_ID)}
+    assert _totals(db) == before
+
+
+def test_open_log_of_member_in_voice_is_kept(db):
+    now = datetime.now(timezone.utc)
+    log = VoiceChatLog(
+        user_id=1,
+        channel_id=CHANNEL_ID,
+        team_id=TEAM_ID,
+        start_time=now - timedelta(hours=1),
+    )
+    db.add(log)
+    db.flush()
+
+    sessions = repositories.reconcile_voice_logs(db, {(1, CHANNEL_ID): TEAM_ID}, now)
+
+    assert sessions == {(1, CHANNEL_ID): log.id}
+    db.refresh(log)
+    assert log.end_time is None
@@ -1,11 +1,13 @@
 import asyncio
 import logging
+import time
 
 import discord
 import sentry_sdk
 from discord.ext import commands
 
 from config import bot_config
+from util import handler_stats, metrics, write_queue
 from util.healthcheck import start_server
 
 logging.basicConfig(
@@ -23,10 +25,42 @@ if bot_config.TOKEN is None or bot_config.TOKEN == "":
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        metrics.install(self)
+        handler_stats.install(self)
+
+    def dispatch(self, event_name: str, *args, **kwargs):
+        metrics.events_total.inc(event=event_name)
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def _run_event(self, coro, event_name: str, *args, **kwargs):
+        # リスナーごとの処理時間を計測する
+        listener = getattr(coro, "__qualname__", event_name)
+        start = time.perf_counter()
+        try:
+            async with handler_stats.measure(listener):
+                await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            metrics.listener_duration.observe(
+                time.perf_counter() - start, listener=listener
+            )
+
+    async def invoke_application_command(self, ctx):
+        async with handler_stats.measure(f"/{ctx.command.qualified_name}"):
+            await super().invoke_application_command(ctx)
 
     @commands.Cog.listener()
     async def on_ready(self):
-        await asyncio.create_task(start_server(self, 8080, 1.0))
+        await asyncio.create_task(
+            start_server(
+                self, bot_config.HEALTHCHECK_HOST, bot_config.HEALTHCHECK_PORT, 1.0
+            )
+        )
+
+    async def close(self):
+        # ゲートウェイを止めて新しいイベントが届かなくなってから、
+        # バッファ済みのログを書き込む
+        await super().close()
+        await write_queue.close_all()
 
 
 # bot init
@@ -39,6 +73,7 @@ bot = Bot(
 
 bot.load_extension("cogs.Admin")
 bot.load_extension("cogs.CogManager")
+bot.load_extension("cogs.TeamCache")
 
 bot.load_extension("cogs.GroupList")
 bot.load_extension("cogs.ParticipantInfo")
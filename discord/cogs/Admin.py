@@ -1,6 +1,8 @@
+from discord import slash_command
 from discord.ext import commands
 
 from config import bot_config
+from util import handler_stats
 
 
 class Admin(commands.Cog):
@@ -11,6 +13,23 @@ class Admin(commands.Cog):
     async def on_ready(self):
         await bot_config.NOTIFY_TO_OWNER(self.bot, "Ready!")
 
+    @slash_command(
+        name="slow_handlers", description="処理時間の長いハンドラを表示します"
+    )
+    @commands.is_owner()
+    async def slow_handlers(self, ctx):
+        message = "```"
+        message += f"{'handler':<40}{'count':>7}{'p50':>8}{'p95':>8}{'p99':>8}"
+        message += f"{'max':>8}{'db':>8}{'api':>8}\n"
+        for stats in handler_stats.slowest(15):
+            message += f"{stats['name'][:39]:<40}{stats['count']:>7}"
+            for key in ("p50", "p95", "p99", "max", "avg_db", "avg_api"):
+                message += f"{stats[key] * 1000:>7.0f}m"
+            message += "\n"
+        message += "```"
+        message += "単位: ms（db, apiは1回あたりの平均）"
+        await ctx.respond(message, ephemeral=True)
+
 
 def setup(bot):
     return bot.add_cog(Admin(bot))
@@ -7,11 +7,123 @@ import discord
 from discord.commands import slash_command
 from sqlalchemy import select
 
+from db.package import repositories
 from db.package.models import Group
-from db.package.session import get_db
+from db.package.session import run_db
+from util.csv_export import send_csv
+from util.group_cache import group_cache
+from util.handler_stats import InstrumentedModal
+from util.message_format import format_listing
+
+
+GROUP_CSV_HEADER = ["id", "name", "short_name", "is_disabled"]
+# 文字列カラムの最大長（models.Group）
+GROUP_NAME_MAX_LENGTH = 255
+
+
+def parse_group_csv(text: str) -> tuple[list[dict], list[str]]:
+    """グループリストのCSVを検証し、(行データ, エラー)を返す
+
+    header: id, name, short_name, is_disabled
+    """
+    reader = csv.DictReader(io.StringIO(text.strip()))
+    missing = [
+        name for name in GROUP_CSV_HEADER if name not in (reader.fieldnames or [])
+    ]
+    if missing:
+        return [], [f"ヘッダーに{', '.join(missing)}がありません"]
+
+    data: list[dict] = []
+    errors: list[str] = []
+    seen_ids: dict[int, int] = {}
+    for row in reader:
+        # ヘッダーを1行目とした行番号
+        line = reader.line_num
+        row_errors = []
+
+        group_id = None
+        raw_id = (row["id"] or "").strip()
+        if raw_id != "":
+            if not raw_id.isdecimal() or int(raw_id) <= 0:
+                row_errors.append(f"idが正しくありません（{raw_id}）")
+            else:
+                group_id = int(raw_id)
+                if group_id in seen_ids:
+                    row_errors.append(
+                        f"id {group_id}が{seen_ids[group_id]}行目と重複しています"
+                    )
+                seen_ids.setdefault(group_id, line)
+
+        for key in ("name", "short_name"):
+            value = (row[key] or "").strip()
+            if value == "":
+                row_errors.append(f"{key}が未入力です")
+            elif len(value) > GROUP_NAME_MAX_LENGTH:
+                row_errors.append(f"{key}が{GROUP_NAME_MAX_LENGTH}文字を超えています")
+
+        is_disabled = (row["is_disabled"] or "").strip()
+        if is_disabled not in ("", "0", "1"):
+            row_errors.append(f"is_disabledは0か1で入力してください（{is_disabled}）")
+
+        if row_errors:
+            errors.extend(f"{line}行目: {error}" for error in row_errors)
+            continue
+
+        data.append(
+            {
+                "id": group_id,
+                "name": row["name"].strip(),
+                "short_name": row["short_name"].strip(),
+                "is_disabled": is_disabled == "1",
+                "line": line,
+            }
+        )
+
+    return data, errors
+
+
+def format_errors(errors: list[str]) -> str:
+    message = f"入力にエラーがあるため保存しませんでした（{len(errors)}件）\n"
+    return message + format_listing(errors)
+
+
+def save_groups(db, data: list[dict]) -> tuple[int, int] | list[str]:
+    """グループを1ステートメントでまとめて登録・更新する
+
+    (新規作成数, 更新数)を返す。存在しないidが指定されている場合は何もせずにエラーを返す。
+    """
+    if not data:
+        return 0, 0
 
+    created, unknown = repositories.upsert_groups(db, data)
+    if unknown:
+        db.rollback()
+        return [
+            f"{row['line']}行目: id {row['id']}のグループが存在しません"
+            for row in unknown
+        ]
+    db.commit()
+    return sum(created), len(created) - sum(created)
 
-class GroupListInput(discord.ui.Modal):
+
+async def import_groups(text: str) -> str:
+    """グループリストのCSVを検証・保存し、結果のメッセージを返す"""
+    data, errors = parse_group_csv(text)
+    if errors:
+        return format_errors(errors)
+
+    result = await run_db(save_groups, data)
+    if isinstance(result, list):
+        return format_errors(result)
+
+    # 所属団体の選択肢に反映する
+    group_cache.invalidate()
+
+    created, updated = result
+    return f"保存しました（新規: {created}件 / 更新: {updated}件）"
+
+
+class GroupListInput(InstrumentedModal):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
@@ -23,47 +135,17 @@ class GroupListInput(discord.ui.Modal):
 
     async def callback(self, interaction: discord.Interaction):
         # レスポンスを遅延
-        await interaction.response.defer()
+        await interaction.response.defer(ephemeral=True)
 
-        # データ取得
-        # header: id, name, short_name, is_disabled
-        raw_data: list[dict] = list(csv.DictReader(self.children[0].value.split("\n")))
-        # idをintに変換
-        data: list[dict] = []
-        for row in raw_data:
-            row["id"] = int(row["id"]) if row["id"] != "" else None
-            row["is_disabled"] = True if row["is_disabled"] == "1" else False
-            data.append(row)
-
-        # idのないものは新規作成
-        new_groups = filter(lambda x: x["id"] is None, data)
-        # idのあるものは更新
-        update_groups = filter(lambda x: x["id"] is not None, data)
-
-        with get_db() as db:
-            # 新規グループを更新
-            try:
-                for group in new_groups:
-                    db.add(Group(**group))
-
-                for group in update_groups:
-                    _g = db.execute(
-                        select(Group).where(Group.id == group["id"])
-                    ).scalar()
-                    if _g:
-                        _g.name = group["name"]
-                        _g.short_name = group["short_name"]
-                        _g.is_disabled = group["is_disabled"]
-                        db.add(_g)
-
-                db.commit()
-            except Exception as e:
-                await interaction.followup.send(
-                    f"エラーが発生しました: {e}", ephemeral=True
-                )
-                raise e
-
-        await interaction.followup.send("保存しました", ephemeral=True)
+        try:
+            message = await import_groups(self.children[0].value)
+        except Exception as e:
+            await interaction.followup.send(
+                f"エラーが発生しました: {e}", ephemeral=True
+            )
+            raise e
+
+        await interaction.followup.send(message, ephemeral=True)
 
 
 class GroupList(discord.Cog):
@@ -83,40 +165,58 @@ class GroupList(discord.Cog):
             )
             return
 
-        with get_db() as db:
-            groups = db.execute(select(Group)).scalars().all()
-
-        # csv形式に変換
+        # csv形式で送信
         # header: id, name, short_name, is_disabled
-        csv_header = "id,name,short_name,is_disabled"
-        csv_body = "\n".join(
-            [
-                f"{group.id},{group.name},{group.short_name},{1 if group.is_disabled else 0}"
-                for group in groups
-            ]
-        )
-
-        csv_data = f"{csv_header}\n{csv_body}"
-
-        # csv_dataを送信
-        await ctx.interaction.followup.send(
+        await send_csv(
+            ctx.interaction.followup.send,
             "グループリスト",
-            file=discord.File(
-                filename=f"group_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                fp=io.BytesIO(csv_data.encode("utf-8")),
+            ctx.guild,
+            f"group_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            ["id", "name", "short_name", "is_disabled"],
+            select(Group.id, Group.name, Group.short_name, Group.is_disabled).order_by(
+                Group.id
             ),
+            lambda row: (row.id, row.name, row.short_name, 1 if row.is_disabled else 0),
         )
 
     @slash_command(name="input_groups", description="グループリストを入力します")
-    async def input_groups(self, ctx: discord.commands.context.ApplicationContext):
+    async def input_groups(
+        self,
+        ctx: discord.commands.context.ApplicationContext,
+        file: discord.Option(
+            discord.Attachment,
+            "CSVファイル（省略時は入力フォームを開きます）",
+            default=None,
+        ),
+    ):
         # server adminのみ実行を許可
         if ctx.author.guild_permissions.administrator is False:
-            await ctx.interaction.followup.send(
+            await ctx.respond(
                 "このコマンドはサーバー管理者のみ実行可能です", ephemeral=True
             )
             return
 
-        await ctx.send_modal(GroupListInput(title="グループリスト入力"))
+        if file is None:
+            await ctx.send_modal(GroupListInput(title="グループリスト入力"))
+            return
+
+        # 入力フォームの文字数制限を超える場合は添付ファイルで受け付ける
+        await ctx.response.defer(ephemeral=True)
+        try:
+            text = (await file.read()).decode("utf-8-sig")
+        except UnicodeDecodeError:
+            await ctx.followup.send(
+                "UTF-8のCSVファイルを添付してください", ephemeral=True
+            )
+            return
+
+        try:
+            message = await import_groups(text)
+        except Exception as e:
+            await ctx.followup.send(f"エラーが発生しました: {e}", ephemeral=True)
+            raise e
+
+        await ctx.followup.send(message, ephemeral=True)
 
 
 def setup(bot):
@@ -1,59 +1,154 @@
-import io
+import asyncio
+import logging
 from datetime import datetime
 
 import discord
 from discord import slash_command
 from discord.ext import commands
-from sqlalchemy import select
+from sqlalchemy import func, select, update
 
-from db.package.models import VoiceChatLog, TextChatLog
-from db.package.session import get_db
+from config import bot_config
+from config.bot_config import parse_datetime
+from db.package import repositories, rollups
+from db.package.models import VoiceChatLog, TextChatLog, TeamActivityHourly
+from db.package.session import run_db
+from util.csv_export import send_csv
+from util.team_cache import team_cache
+from util.write_queue import WriteBehindQueue
 
 
 class Logger(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # テキストチャットログはバッファしてまとめて書き込む
+        self.text_log_queue = WriteBehindQueue(
+            TextChatLog,
+            name="text_chat_logs",
+            batch_size=bot_config.TEXT_LOG_BATCH_SIZE,
+            flush_interval=bot_config.TEXT_LOG_FLUSH_INTERVAL,
+            max_size=bot_config.TEXT_LOG_MAX_QUEUE_SIZE,
+            # 書き込みと同じトランザクションで時間別ロールアップを更新する
+            after_write=rollups.add_text_messages,
+        )
+        # (member_id, channel_id) -> 開いているボイスチャットログのID
+        self.voice_sessions: dict[tuple[int, int], asyncio.Future] = {}
+        self._background_tasks: set[asyncio.Task] = set()
+        # リロード時はon_readyが呼ばれないため、ここで再構築する
+        if bot.is_ready():
+            self._spawn(self._restore_voice_sessions())
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def cog_unload(self):
+        # アンロード時に残りのログを書き込む
+        self._spawn(self.text_log_queue.close())
 
     # ボイスチャットログ
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self._restore_voice_sessions()
+
+    async def _restore_voice_sessions(self):
+        """DB上の未終了ログと現在のボイス状態から、開いているセッションを再構築する"""
+        current = {}
+        for guild in self.bot.guilds:
+            for channel in [*guild.voice_channels, *guild.stage_channels]:
+                for member in channel.members:
+                    team_id = team_cache.get(member)
+                    if team_id is not None:
+                        current[(member.id, channel.id)] = team_id
+
+        sessions = await run_db(
+            repositories.reconcile_voice_logs, current, discord.utils.utcnow()
+        )
+
+        loop = asyncio.get_running_loop()
+        restored = {}
+        for key, log_id in sessions.items():
+            future = loop.create_future()
+            future.set_result(log_id)
+            restored[key] = future
+        # 再構築中に発生したイベントの結果を優先する
+        self.voice_sessions = {**restored, **self.voice_sessions}
+
+        logging.info(f"Restored {len(sessions)} open voice session(s)")
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
         if not isinstance(member, discord.Member):
             return
 
-        # メンバーのロールから"チーム"で始まるものを取得し、チームIDとする
-        team_id = None
-        for role in member.roles:
-            if role.name.startswith("チーム"):
-                team_id = role.name.removeprefix("チーム")
-                break
+        before_channel = before.channel
+        after_channel = after.channel
 
-        if team_id is None:
+        # ミュート切り替え等、チャンネルが変わらないものは無視
+        if before_channel == after_channel:
             return
 
-        if before.channel is None and after.channel is not None:
-            with get_db() as db:
-                db.add(
-                    VoiceChatLog(
-                        channel_id=after.channel.id,
-                        team_id=team_id,
-                        start_time=datetime.now(),
-                        end_time=None,
-                    )
-                )
-                db.commit()
-        elif before.channel is not None and after.channel is None:
-            with get_db() as db:
-                _t = db.execute(
-                    select(VoiceChatLog)
-                    .where(VoiceChatLog.channel_id == before.channel.id)
-                    .order_by(VoiceChatLog.start_time.desc())
-                    .limit(1)
-                ).scalar()
-
-                if _t:
-                    _t.end_time = datetime.now()
-                    db.add(_t)
-                    db.commit()
+        now = discord.utils.utcnow()
+
+        # 退出・移動元のセッションを閉じる
+        if before_channel is not None:
+            self._close_voice_session(member.id, before_channel.id, now)
+
+        # 参加・移動先のセッションを開く
+        if after_channel is not None:
+            team_id = team_cache.get(member)
+            if team_id is not None:
+                self._open_voice_session(member.id, after_channel.id, team_id, now)
+
+    def _open_voice_session(
+        self, member_id: int, channel_id: int, team_id: str, start_time: datetime
+    ):
+        # INSERTの完了を待たずに登録し、直後の退出でもIDを参照できるようにする
+        self.voice_sessions[(member_id, channel_id)] = self._spawn(
+            run_db(self._open_voice_log, member_id, channel_id, team_id, start_time)
+        )
+
+    def _close_voice_session(self, member_id: int, channel_id: int, end_time: datetime):
+        future = self.voice_sessions.pop((member_id, channel_id), None)
+        if future is None:
+            return
+        self._spawn(self._close_voice_log_async(future, end_time))
+
+    async def _close_voice_log_async(self, future: asyncio.Future, end_time: datetime):
+        try:
+            log_id = await future
+            await run_db(self._close_voice_log, log_id, end_time)
+        except Exception as e:
+            logging.error(f"Failed to close voice chat log: {e}")
+
+    @staticmethod
+    def _open_voice_log(
+        db, member_id: int, channel_id: int, team_id: str, start_time: datetime
+    ) -> int:
+        log = VoiceChatLog(
+            user_id=member_id,
+            channel_id=channel_id,
+            team_id=team_id,
+            start_time=start_time,
+            end_time=None,
+        )
+        db.add(log)
+        db.commit()
+        return log.id
+
+    @staticmethod
+    def _close_voice_log(db, log_id: int, end_time: datetime):
+        closed = db.execute(
+            update(VoiceChatLog)
+            .where(VoiceChatLog.id == log_id, VoiceChatLog.end_time.is_(None))
+            .values(end_time=end_time)
+            .returning(VoiceChatLog.team_id, VoiceChatLog.start_time)
+        ).all()
+        rollups.add_voice_sessions(
+            db, [(team_id, start_time, end_time) for team_id, start_time in closed]
+        )
+        db.commit()
 
     # テキストチャットログ
     @commands.Cog.listener()
@@ -61,129 +156,328 @@ class Logger(commands.Cog):
         if not isinstance(message.author, discord.Member):
             return
 
-        # メンバーのロールから"チーム"で始まるものを取得し、チームIDとする
-        team_id = None
-        for role in message.author.roles:
-            if role.name.startswith("チーム"):
-                team_id = role.name.removeprefix("チーム")
-                break
-
+        team_id = team_cache.get(message.author)
         if team_id is None:
             return
 
-        with get_db() as db:
-            db.add(
-                TextChatLog(
-                    channel_id=message.channel.id,
-                    team_id=team_id,
-                    message_id=message.id,
-                )
+        self.text_log_queue.put(
+            {
+                "channel_id": message.channel.id,
+                "team_id": team_id,
+                "message_id": message.id,
+                # フラッシュ時刻ではなく送信時刻を記録する
+                "created_at": message.created_at,
+            }
+        )
+
+    @slash_command(
+        name="log_queue_status", description="ログ書き込みキューの状態を表示します"
+    )
+    @commands.has_permissions(administrator=True)
+    async def log_queue_status(self, ctx):
+        stats = self.text_log_queue.stats()
+        message = "```"
+        message += f"キュー長: {stats['depth']}\n"
+        message += f"投入数: {stats['enqueued_total']}\n"
+        message += f"書き込み数: {stats['flushed_total']}\n"
+        message += f"失敗数: {stats['failed_total']}\n"
+        message += f"破棄数: {stats['dropped_total']}\n"
+        message += f"フラッシュ回数: {stats['flush_count']}\n"
+        message += f"フラッシュ失敗回数: {stats['failed_flush_count']}\n"
+        message += f"直近フラッシュ: {stats['last_flush_seconds'] * 1000:.1f}ms\n"
+        message += f"平均フラッシュ: {stats['avg_flush_seconds'] * 1000:.1f}ms\n"
+        message += f"最大フラッシュ: {stats['max_flush_seconds'] * 1000:.1f}ms\n"
+        message += "```"
+        await ctx.respond(message, ephemeral=True)
+
+    @slash_command(
+        name="backfill_activity_rollup",
+        description="既存のログから時間別アクティビティ集計を再構築します",
+    )
+    @commands.has_permissions(administrator=True)
+    async def backfill_activity_rollup(self, ctx):
+        await ctx.response.defer(ephemeral=True)
+
+        # バッファ中のログも集計に含めるため、先にキューを書き込む
+        await self.text_log_queue.flush()
+        count = await run_db(rollups.rebuild)
+
+        await ctx.followup.send(f"{count}件の集計行を再構築しました", ephemeral=True)
+
+    @slash_command(
+        name="team_activity", description="チームごとのアクティビティを集計表から表示します"
+    )
+    @commands.has_permissions(administrator=True)
+    async def team_activity(
+            self,
+            ctx,
+            since: discord.Option(str, "開始日時（YYYY-MM-DD HH:MM、時単位）", default=None),
+            until: discord.Option(str, "終了日時（YYYY-MM-DD HH:MM、時単位）", default=None),
+            team_id: discord.Option(str, "チームID", default=None),
+    ):
+        await ctx.response.defer(ephemeral=True)
+
+        try:
+            since_dt = parse_datetime(since)
+            until_dt = parse_datetime(until)
+        except ValueError:
+            await ctx.followup.send("日時の形式が正しくありません", ephemeral=True)
+            return
+
+        team_activity = await run_db(
+            self._sum_team_activity, since_dt, until_dt, team_id
+        )
+
+        # メッセージ作成
+        message = "```"
+        for _team_id, total_messages, total_seconds in team_activity:
+            message += (
+                f"チーム{_team_id}: {total_messages}メッセージ / {int(total_seconds)}秒\n"
             )
-            db.commit()
+        message += "```"
+
+        await ctx.followup.send(message, ephemeral=True)
+
+    @staticmethod
+    def _activity_filter(
+        stmt, since: datetime | None, until: datetime | None, team_id: str | None
+    ):
+        # 集計表は時単位のため、期間は時単位に切り捨てて比較する
+        if since is not None:
+            stmt = stmt.where(TeamActivityHourly.hour >= rollups.floor_hour(since))
+        if until is not None:
+            stmt = stmt.where(TeamActivityHourly.hour < until)
+        if team_id is not None:
+            stmt = stmt.where(TeamActivityHourly.team_id == team_id)
+        return stmt
+
+    @staticmethod
+    def _sum_team_activity(
+        db, since: datetime | None, until: datetime | None, team_id: str | None
+    ) -> list[tuple[str, int, float]]:
+        total_messages = func.sum(TeamActivityHourly.message_count).label("messages")
+        total_seconds = func.sum(TeamActivityHourly.voice_seconds).label("seconds")
+        stmt = (
+            select(TeamActivityHourly.team_id, total_messages, total_seconds)
+            .group_by(TeamActivityHourly.team_id)
+            .order_by(TeamActivityHourly.team_id)
+        )
+        stmt = Logger._activity_filter(stmt, since, until, team_id)
+        return [tuple(row) for row in db.execute(stmt).all()]
+
+    @slash_command(
+        name="output_activity_csv",
+        description="チームごとの時間別アクティビティをCSV形式で出力します",
+    )
+    @commands.has_permissions(administrator=True)
+    async def output_activity_csv(
+            self,
+            ctx,
+            since: discord.Option(str, "開始日時（YYYY-MM-DD HH:MM、時単位）", default=None),
+            until: discord.Option(str, "終了日時（YYYY-MM-DD HH:MM、時単位）", default=None),
+            team_id: discord.Option(str, "チームID", default=None),
+    ):
+        await ctx.response.defer(ephemeral=True)
+
+        try:
+            since_dt = parse_datetime(since)
+            until_dt = parse_datetime(until)
+        except ValueError:
+            await ctx.followup.send("日時の形式が正しくありません", ephemeral=True)
+            return
+
+        stmt = select(
+            TeamActivityHourly.team_id,
+            TeamActivityHourly.hour,
+            TeamActivityHourly.message_count,
+            TeamActivityHourly.voice_seconds,
+        ).order_by(TeamActivityHourly.team_id, TeamActivityHourly.hour)
+
+        await send_csv(
+            ctx.followup.send,
+            "時間別アクティビティ",
+            ctx.guild,
+            "team_activity_hourly.csv",
+            ["team_id", "hour", "message_count", "voice_seconds"],
+            self._activity_filter(stmt, since_dt, until_dt, team_id),
+            ephemeral=True,
+        )
 
     @slash_command(name="list_voice_chat_logs", description="ボイスチャットログを表示します")
     @commands.has_permissions(administrator=True)
-    async def list_voice_chat_logs(self, ctx):
+    async def list_voice_chat_logs(
+            self,
+            ctx,
+            since: discord.Option(str, "開始日時（YYYY-MM-DD HH:MM）", default=None),
+            until: discord.Option(str, "終了日時（YYYY-MM-DD HH:MM）", default=None),
+            team_id: discord.Option(str, "チームID", default=None),
+            channel: discord.Option(
+                discord.SlashCommandOptionType.channel, "チャンネル", default=None
+            ),
+    ):
         await ctx.response.defer(ephemeral=True)
-        with get_db() as db:
-            logs = db.execute(select(VoiceChatLog)).scalars().all()
 
-        # チームごとに合計時間を計算
-        team_logs = {}
-        for log in logs:
-            if log.end_time is None:
-                continue
-            if log.team_id not in team_logs:
-                team_logs[log.team_id] = 0
-            team_logs[log.team_id] += (log.end_time - log.start_time).seconds
+        try:
+            since_dt = parse_datetime(since)
+            until_dt = parse_datetime(until)
+        except ValueError:
+            await ctx.followup.send("日時の形式が正しくありません", ephemeral=True)
+            return
 
-        # 多い順にソート
-        sorted_team_logs = sorted(team_logs.items(), key=lambda x: x[1], reverse=True)
+        # チームごとの合計時間（秒）をDB側で集計
+        team_logs = await run_db(
+            self._sum_voice_seconds,
+            since_dt,
+            until_dt,
+            team_id,
+            channel.id if channel else None,
+        )
 
         # メッセージ作成
         message = "```"
-        for team_id, total_time in sorted_team_logs:
-            message += f"チーム{team_id}: {total_time}秒\n"
+        for _team_id, total_time in team_logs:
+            message += f"チーム{_team_id}: {int(total_time)}秒\n"
         message += "```"
 
         await ctx.followup.send(message, ephemeral=True)
 
+    @staticmethod
+    def _sum_voice_seconds(
+        db,
+        since: datetime | None,
+        until: datetime | None,
+        team_id: str | None,
+        channel_id: int | None,
+    ) -> list[tuple[str, float]]:
+        # 期間が指定されている場合は期間内に収まる部分のみを集計する
+        start_time = VoiceChatLog.start_time
+        end_time = VoiceChatLog.end_time
+        if since is not None:
+            start_time = func.greatest(start_time, since)
+        if until is not None:
+            end_time = func.least(end_time, until)
+
+        total = func.sum(func.extract("epoch", end_time - start_time)).label("total")
+        stmt = (
+            select(VoiceChatLog.team_id, total)
+            .where(VoiceChatLog.end_time.is_not(None))
+            .group_by(VoiceChatLog.team_id)
+            .order_by(total.desc())
+        )
+        if since is not None:
+            stmt = stmt.where(VoiceChatLog.end_time > since)
+        if until is not None:
+            stmt = stmt.where(VoiceChatLog.start_time < until)
+        if team_id is not None:
+            stmt = stmt.where(VoiceChatLog.team_id == team_id)
+        if channel_id is not None:
+            stmt = stmt.where(VoiceChatLog.channel_id == channel_id)
+
+        return [tuple(row) for row in db.execute(stmt).all()]
+
     @slash_command(name='output_text_csv', description='テキストチャットログをCSV形式で出力します')
     @commands.has_permissions(administrator=True)
     async def output_text_csv(self, ctx):
         await ctx.response.defer(ephemeral=True)
 
-        with get_db() as db:
-            logs = db.execute(select(TextChatLog)).scalars().all()
-
-        csv_header = "team_id,channel_id,message_id,created_at"
-        csv_body = "\n".join(
-            [
-                f"{log.team_id},{log.channel_id},{log.message_id},{log.created_at}"
-                for log in logs
-            ]
-        )
-
         # メッセージ作成
-        await ctx.followup.send(
+        await send_csv(
+            ctx.followup.send,
             "テキストチャットログ",
-            file=discord.File(
-                fp=io.BytesIO(f"{csv_header}\n{csv_body}".encode('utf-8')),
-                filename="text_chat_logs.csv"
-            ),
-            ephemeral=True
+            ctx.guild,
+            "text_chat_logs.csv",
+            ["team_id", "channel_id", "message_id", "created_at"],
+            select(
+                TextChatLog.team_id,
+                TextChatLog.channel_id,
+                TextChatLog.message_id,
+                TextChatLog.created_at,
+            ).order_by(TextChatLog.id),
+            ephemeral=True,
         )
 
     @slash_command(name="list_text_chat_logs", description="テキストチャットログを表示します")
     @commands.has_permissions(administrator=True)
-    async def list_text_chat_logs(self, ctx):
+    async def list_text_chat_logs(
+            self,
+            ctx,
+            since: discord.Option(str, "開始日時（YYYY-MM-DD HH:MM）", default=None),
+            until: discord.Option(str, "終了日時（YYYY-MM-DD HH:MM）", default=None),
+            team_id: discord.Option(str, "チームID", default=None),
+            channel: discord.Option(
+                discord.SlashCommandOptionType.channel, "チャンネル", default=None
+            ),
+    ):
         await ctx.response.defer(ephemeral=True)
 
-        with get_db() as db:
-            logs = db.execute(select(TextChatLog)).scalars().all()
-
-        # チームごとにメッセージ数を計算
-        team_logs = {}
-        for log in logs:
-            if log.team_id not in team_logs:
-                team_logs[log.team_id] = 0
-            team_logs[log.team_id] += 1
+        try:
+            since_dt = parse_datetime(since)
+            until_dt = parse_datetime(until)
+        except ValueError:
+            await ctx.followup.send("日時の形式が正しくありません", ephemeral=True)
+            return
 
-        # 多い順にソート
-        sorted_team_logs = sorted(team_logs.items(), key=lambda x: x[1], reverse=True)
+        # チームごとのメッセージ数をDB側で集計
+        team_logs = await run_db(
+            self._count_text_messages,
+            since_dt,
+            until_dt,
+            team_id,
+            channel.id if channel else None,
+        )
 
         # メッセージ作成
         message = "```"
-        for team_id, total_messages in sorted_team_logs:
-            message += f"チーム{team_id}: {total_messages}メッセージ\n"
+        for _team_id, total_messages in team_logs:
+            message += f"チーム{_team_id}: {total_messages}メッセージ\n"
         message += "```"
 
         await ctx.followup.send(message, ephemeral=True)
 
+    @staticmethod
+    def _count_text_messages(
+        db,
+        since: datetime | None,
+        until: datetime | None,
+        team_id: str | None,
+        channel_id: int | None,
+    ) -> list[tuple[str, int]]:
+        total = func.count().label("total")
+        stmt = (
+            select(TextChatLog.team_id, total)
+            .group_by(TextChatLog.team_id)
+            .order_by(total.desc())
+        )
+        if since is not None:
+            stmt = stmt.where(TextChatLog.created_at >= since)
+        if until is not None:
+            stmt = stmt.where(TextChatLog.created_at < until)
+        if team_id is not None:
+            stmt = stmt.where(TextChatLog.team_id == team_id)
+        if channel_id is not None:
+            stmt = stmt.where(TextChatLog.channel_id == channel_id)
+
+        return [tuple(row) for row in db.execute(stmt).all()]
+
     @slash_command(name="output_voice_csv", description="ボイスチャットログをCSV形式で出力します")
     @commands.has_permissions(administrator=True)
     async def output_voice_csv(self, ctx):
         await ctx.response.defer(ephemeral=True)
 
-        with get_db() as db:
-            logs = db.execute(select(VoiceChatLog)).scalars().all()
-
-        csv_header = "team_id,channel_id,start_time,end_time"
-        csv_body = "\n".join(
-            [
-                f"{log.team_id},{log.channel_id},{log.start_time},{log.end_time}"
-                for log in logs
-            ]
-        )
-
         # メッセージ作成
-        await ctx.followup.send(
+        await send_csv(
+            ctx.followup.send,
             "ボイスチャットログ",
-            file=discord.File(
-                fp=io.BytesIO(f"{csv_header}\n{csv_body}".encode('utf-8')),
-                filename="voice_chat_logs.csv"
-            ),
-            ephemeral=True
+            ctx.guild,
+            "voice_chat_logs.csv",
+            ["team_id", "channel_id", "start_time", "end_time"],
+            select(
+                VoiceChatLog.team_id,
+                VoiceChatLog.channel_id,
+                VoiceChatLog.start_time,
+                VoiceChatLog.end_time,
+            ).order_by(VoiceChatLog.id),
+            ephemeral=True,
         )
 
 
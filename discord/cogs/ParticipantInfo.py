@@ -1,16 +1,98 @@
+import asyncio
 import csv
 import io
 import logging
 import re
 from datetime import datetime
+from functools import partial
 
 import discord
 from discord import slash_command
 from discord.ext import commands
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from db.package import repositories
+from db.package.models import Participant
+from db.package.session import run_db
+from util.bulk_ops import edit_progress, run_bulk
+from util.csv_export import send_csv
+from util.group_cache import group_cache
+from util.handler_stats import InstrumentedModal, InstrumentedView
+from util.message_format import format_listing
+from util.team_cache import team_cache
+from util.wizard_state import wizard_state
+
+PARTICIPANT_CSV_HEADER = [
+    "id",
+    "last_name",
+    "first_name",
+    "group_id",
+    "github_user_name",
+    "discord_user_id",
+]
+PARTICIPANT_CSV_COLUMNS = [getattr(Participant, name) for name in PARTICIPANT_CSV_HEADER]
+
+
+def parse_participant_csv(text: str) -> tuple[list[tuple], list[str]]:
+    """list_participantsと同じ形式のCSVを検証し、(取り込む行, 却下理由)を返す
+
+    idは無視し、discord_user_idで既存の参加者と照合する。
+    """
+    reader = csv.DictReader(io.StringIO(text.strip()))
+    missing = [
+        name
+        for name in repositories.PARTICIPANT_IMPORT_COLUMNS
+        if name not in (reader.fieldnames or [])
+    ]
+    if missing:
+        return [], [f"ヘッダーに{', '.join(missing)}がありません"]
+
+    rows: list[tuple] = []
+    rejections: list[str] = []
+    seen: dict[int, int] = {}
+    for row in reader:
+        line = reader.line_num
+        values = {
+            key: (row[key] or "").strip()
+            for key in repositories.PARTICIPANT_IMPORT_COLUMNS
+        }
+        errors = [
+            f"{key}が未入力です"
+            for key in repositories.PARTICIPANT_IMPORT_COLUMNS
+            if values[key] == ""
+        ]
+        for key in ("group_id", "discord_user_id"):
+            if values[key] != "" and not values[key].isdecimal():
+                errors.append(f"{key}が数値ではありません（{values[key]}）")
+        # GitHubのURLが入力されている場合はユーザー名を取り出す
+        github = re.match(r"https://github\.com/([^/]+)", values["github_user_name"])
+        if github:
+            values["github_user_name"] = github.group(1)
+
+        if not errors:
+            discord_user_id = int(values["discord_user_id"])
+            if discord_user_id in seen:
+                errors.append(
+                    f"discord_user_idが{seen[discord_user_id]}行目と重複しています"
+                )
+            seen.setdefault(discord_user_id, line)
+
+        if errors:
+            rejections.extend(f"{line}行目: {error}" for error in errors)
+            continue
+
+        rows.append(
+            (
+                values["last_name"],
+                values["first_name"],
+                int(values["group_id"]),
+                values["github_user_name"],
+                int(values["discord_user_id"]),
+            )
+        )
 
-from db.package.models import Group, Participant, UserSessionStorage
-from db.package.session import get_db
+    return rows, rejections
 
 
 class ParticipantInfo(commands.Cog):
@@ -19,8 +101,16 @@ class ParticipantInfo(commands.Cog):
 
     @commands.Cog.listener()
     async def on_ready(self):
+        try:
+            await group_cache.load()
+        except Exception as e:
+            # 読み込めなかった場合は初回の選択時に再試行する
+            logging.error(f"Failed to load groups: {e}")
+
         self.bot.add_view(ParticipantInputStartButton())
-        self.bot.add_view(GroupSelectorView())
+        # 再起動前に送信された選択肢のページ送りも処理できるよう全ページを登録
+        for page in range(GroupSelectorView.page_count()):
+            self.bot.add_view(GroupSelectorView(page=page))
         self.bot.add_view(ParticipantInfoModalOpenButton())
         self.bot.add_view(ParticipantInfoConfirmButton())
 
@@ -67,30 +157,76 @@ class ParticipantInfo(commands.Cog):
             )
             return
 
-        with get_db() as db:
-            participants = db.execute(select(Participant)).scalars().all()
+        # 遅延
+        await ctx.response.defer(ephemeral=True)
 
-        # csv形式に変換
+        # csv形式で送信
         # header: id, last_name, first_name, group_id, github_user_name, discord_user_id
-        csv_header = "id,last_name,first_name,group_id,github_user_name,discord_user_id"
-        csv_body = "\n".join(
-            [
-                f"{participant.id},{participant.last_name},{participant.first_name},{participant.group_id},{participant.github_user_name},{participant.discord_user_id}"
-                for participant in participants
-            ]
+        await send_csv(
+            ctx.followup.send,
+            "参加者情報をCSVで表示します",
+            ctx.guild,
+            f"participants_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            PARTICIPANT_CSV_HEADER,
+            select(*PARTICIPANT_CSV_COLUMNS).order_by(Participant.id),
+            ephemeral=True,
         )
 
-        csv_data = f"{csv_header}\n{csv_body}"
-
-        # csv_dataを送信
-        await ctx.respond(
-            "参加者情報をCSVで表示します",
-            file=discord.File(
-                filename=f"participants_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                fp=io.BytesIO(csv_data.encode())
+    @slash_command(
+        name="import_participants", description="参加者情報をCSVから一括登録・更新します"
+    )
+    async def import_participants(
+            self,
+            ctx: discord.ApplicationContext,
+            file: discord.Option(
+                discord.Attachment, "list_participantsと同じ形式のCSVファイル"
             ),
-            ephemeral=True,
+    ):
+        # Adminに限定
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.respond(
+                "このコマンドはサーバー管理者のみ実行可能です", ephemeral=True
+            )
+            return
+
+        # 遅延
+        await ctx.response.defer(ephemeral=True)
+
+        try:
+            text = (await file.read()).decode("utf-8-sig")
+        except UnicodeDecodeError:
+            await ctx.followup.send("UTF-8のCSVファイルを添付してください", ephemeral=True)
+            return
+
+        # 検証はDBに触れる前にまとめて行う
+        rows, rejections = await asyncio.to_thread(parse_participant_csv, text)
+
+        inserted = updated = 0
+        if rows:
+            try:
+                inserted, updated, unknown_group = await run_db(
+                    repositories.import_participants, rows
+                )
+            except Exception as e:
+                await ctx.followup.send(
+                    f"エラーが発生しました: {e}", ephemeral=True
+                )
+                raise e
+            group_ids = {row[4]: row[2] for row in rows}
+            rejections.extend(
+                f"discord_user_id {discord_user_id}: "
+                f"グループ{group_ids[discord_user_id]}が存在しません"
+                for discord_user_id in unknown_group
+            )
+
+        message = (
+            f"参加者情報を取り込みました（新規: {inserted}件 / 更新: {updated}件 / "
+            f"却下: {len(rejections)}件）"
         )
+        if rejections:
+            message += "\n" + format_listing(rejections)
+
+        await ctx.followup.send(message, ephemeral=True)
 
     @slash_command(name="update_participant_info", description="参加者情報を更新します")
     async def update_participant_info(
@@ -110,55 +246,69 @@ class ParticipantInfo(commands.Cog):
             return
 
         try:
-            with get_db() as db:
-                # 既存データ取得
-                participant = db.execute(
-                    select(Participant).where(Participant.discord_user_id == user.id)
-                ).scalar()
-
-                if not participant:
-                    # 新規作成
-                    # 1つでも未入力の場合はエラー
-                    if (
-                            not last_name
-                            or not first_name
-                            or not github_url
-                            or not group_id
-                    ):
-                        await ctx.respond(
-                            "エラー：新規作成：未入力あり", ephemeral=True
-                        )
-                        return
-
-                    participant = Participant(
-                        last_name=last_name,
-                        first_name=first_name,
-                        group_id=group_id,
-                        github_user_name=github_url,
-                        discord_user_id=user.id,
-                    )
-                    db.add(participant)
-                    db.commit()
-                    await ctx.respond("新規作成しました", ephemeral=True)
-                else:
-                    # 更新
-                    if last_name:
-                        participant.last_name = last_name
-                    if first_name:
-                        participant.first_name = first_name
-                    if github_url:
-                        participant.github_user_name = github_url
-                    if group_id:
-                        participant.group_id = group_id
-                    db.add(participant)
-                    db.commit()
-                    await ctx.respond("更新しました", ephemeral=True)
+            result = await run_db(
+                self._update_participant,
+                user.id,
+                group_id,
+                last_name,
+                first_name,
+                github_url,
+            )
         except Exception as e:
             await ctx.respond(
                 f"エラーが発生しました。再度お試しください。", ephemeral=True
             )
             raise e
 
+        if result == "missing":
+            await ctx.respond("エラー：新規作成：未入力あり", ephemeral=True)
+        elif result == "created":
+            await ctx.respond("新規作成しました", ephemeral=True)
+        else:
+            await ctx.respond("更新しました", ephemeral=True)
+
+    @staticmethod
+    def _update_participant(
+            db,
+            discord_user_id: int,
+            group_id: int | None,
+            last_name: str | None,
+            first_name: str | None,
+            github_url: str | None,
+    ) -> str:
+        # 既存データ取得
+        participant = repositories.get_participant(db, discord_user_id)
+
+        if not participant:
+            # 新規作成
+            # 1つでも未入力の場合はエラー
+            if not last_name or not first_name or not github_url or not group_id:
+                return "missing"
+
+            participant = Participant(
+                last_name=last_name,
+                first_name=first_name,
+                group_id=group_id,
+                github_user_name=github_url,
+                discord_user_id=discord_user_id,
+            )
+            db.add(participant)
+            db.commit()
+            return "created"
+
+        # 更新
+        if last_name:
+            participant.last_name = last_name
+        if first_name:
+            participant.first_name = first_name
+        if github_url:
+            participant.github_user_name = github_url
+        if group_id:
+            participant.group_id = group_id
+        db.add(participant)
+        db.commit()
+        return "updated"
+
     @slash_command(
         name="add_role_for_participants",
         description="登録済み参加者にロールを付与します",
@@ -184,12 +334,8 @@ class ParticipantInfo(commands.Cog):
         # 遅延
         await ctx.response.defer(ephemeral=True)
 
-        with get_db() as db:
-            participants = db.execute(select(Participant)).scalars().all()
-            # 現在の登録済みユーザ
-            target_user_ids = [
-                participant.discord_user_id for participant in participants
-            ]
+        # 現在の登録済みユーザ
+        target_user_ids = await run_db(repositories.list_participant_discord_user_ids)
 
         if inverse:
             # 非登録ユーザにロールを付与する場合
@@ -222,19 +368,34 @@ class ParticipantInfo(commands.Cog):
             ctx.guild.get_member(user_id) for user_id in remove_target_user_ids
         ]
 
-        # ロール付与
-        for user in new_target_users:
-            if user:
+        # (メンバー, 付与するか)の一覧
+        operations = [(user, True) for user in new_target_users if user] + [
+            (user, False) for user in remove_target_users if user
+        ]
+
+        async def apply(operation):
+            user, add = operation
+            if add:
                 logging.info(f"add role: {role.name} to {user.display_name}")
                 await user.add_roles(role)
-
-        # ロール削除
-        for user in remove_target_users:
-            if user:
+            else:
                 logging.info(f"remove role: {role.name} from {user.display_name}")
                 await user.remove_roles(role)
 
-        await ctx.followup.send("ロールを付与しました", ephemeral=True)
+        # ロール付与・削除
+        result = await run_bulk(
+            operations,
+            apply,
+            progress=edit_progress(ctx.interaction, "ロールを更新中"),
+        )
+
+        await ctx.interaction.edit_original_response(
+            content=result.summary(
+                f"ロールを更新しました（付与: {len(new_target_users)}件 / "
+                f"削除: {len(remove_target_users)}件）",
+                lambda op: f"{'付与' if op[1] else '削除'} {op[0].display_name}",
+            )
+        )
 
     @slash_command(name="set_nick", description="ユーザのニックネームを設定します")
     async def set_nick(
@@ -259,44 +420,59 @@ class ParticipantInfo(commands.Cog):
         # 遅延
         await ctx.response.defer(ephemeral=True)
 
-        with get_db() as db:
-            participants = db.execute(select(Participant)).scalars().all()
+        participants = await run_db(repositories.list_participants_with_group)
 
-            for participant in participants:
-                member = ctx.guild.get_member(participant.discord_user_id)
+        # 変更が必要なメンバーと新しいニックネームを計算する
+        operations = []
+        skipped = 0
+        for participant in participants:
+            member = ctx.guild.get_member(participant.discord_user_id)
 
-                if not member:
-                    continue
+            if not member:
+                continue
 
-                if target_role and target_role not in member.roles:
-                    continue
+            if target_role and target_role not in member.roles:
+                continue
 
-                # admin権限持ちはニックネームを変更しない
-                if member.guild_permissions.administrator:
-                    continue
+            # admin権限持ちはニックネームを変更しない
+            if member.guild_permissions.administrator:
+                continue
 
-                # ロールから"チーム"で始まるものを取得し、その後の文字列を取得
-                team = "?"
-                for role in member.roles:
-                    if role.name.startswith("チーム"):
-                        team = role.name.removeprefix("チーム")
-                        break
+            # ロールから"チーム"で始まるものを取得し、その後の文字列を取得
+            team = team_cache.get(member) or "?"
 
-                # フォーマット
-                nick = format_str.format(
-                    team=team,
-                    last_name=participant.last_name,
-                    first_name=participant.first_name,
-                    group_short_name=participant.group.short_name,
-                )
+            # フォーマット
+            nick = format_str.format(
+                team=team,
+                last_name=participant.last_name,
+                first_name=participant.first_name,
+                group_short_name=participant.group.short_name,
+            )
 
-                try:
-                    await member.edit(nick=nick)
-                except Exception as e:
-                    logging.error(f"nick set error: {e}")
-                    continue
+            # 既に設定済みの場合はAPIを呼ばない
+            if member.nick == nick:
+                skipped += 1
+                continue
+
+            operations.append((member, nick))
+
+        async def apply(operation):
+            member, nick = operation
+            await member.edit(nick=nick)
+
+        result = await run_bulk(
+            operations,
+            apply,
+            progress=edit_progress(ctx.interaction, "ニックネームを設定中"),
+        )
 
-        await ctx.followup.send("ニックネームを設定しました", ephemeral=True)
+        await ctx.interaction.edit_original_response(
+            content=result.summary(
+                f"ニックネームを設定しました（変更: {len(result.succeeded)}件 / "
+                f"設定済み: {skipped}件）",
+                lambda op: f"{op[0].display_name} -> {op[1]}",
+            )
+        )
 
     @slash_command(
         name="list_for_modify_role", description="ロール一括修正用のリストを表示します"
@@ -318,9 +494,6 @@ class ParticipantInfo(commands.Cog):
         # 遅延
         await ctx.response.defer(ephemeral=True)
 
-        with get_db() as db:
-            participants = db.execute(select(Participant)).scalars().all()
-
         if target_roles_str:
             # target_roles_strからロールIDを正規表現で取得
             role_ids = re.findall(r"\d+", target_roles_str)
@@ -334,38 +507,28 @@ class ParticipantInfo(commands.Cog):
         else:
             roles = ctx.guild.roles
 
-        csv_header = (
-                "id,last_name,first_name,group_id,github_user_name,discord_user_id,"
-                + ",".join(reversed([role.name for role in roles]))
-        )
-        csv_body_list = []
-        for participant in participants:
-            member = ctx.guild.get_member(participant.discord_user_id)
-            if not member:
-                continue
-
-            # ロールが付与されているか
-            role_str = ",".join(
-                reversed(["1" if role in member.roles else "" for role in roles])
-            )
-
-            csv_body = (
-                    f"{participant.id},{participant.last_name},{participant.first_name}," +
-                    f"{participant.group_id},{participant.github_user_name},{participant.discord_user_id}," +
-                    role_str
-            )
+        roles = list(reversed(roles))
 
-            csv_body_list.append(csv_body)
+        # メンバーごとのロール付与状況（1: 付与済み）
+        role_flags = {
+            member.id: ["1" if role in member.roles else "" for role in roles]
+            for member in ctx.guild.members
+        }
 
-        csv_body = "\n".join(csv_body_list)
-        csv_data = f"{csv_header}\n{csv_body}"
+        def to_row(row):
+            flags = role_flags.get(row.discord_user_id)
+            if flags is None:
+                return None
+            return (*row, *flags)
 
-        await ctx.followup.send(
+        await send_csv(
+            ctx.followup.send,
             "ロール一括修正用のリストを表示します",
-            file=discord.File(
-                filename=f"modify_roles_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                fp=io.BytesIO(csv_data.encode())
-            ),
+            ctx.guild,
+            f"modify_roles_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            PARTICIPANT_CSV_HEADER + [role.name for role in roles],
+            select(*PARTICIPANT_CSV_COLUMNS).order_by(Participant.id),
+            to_row,
             ephemeral=True,
         )
 
@@ -375,6 +538,9 @@ class ParticipantInfo(commands.Cog):
     async def modify_role_from_csv(
             self,
             ctx: discord.ApplicationContext,
+            dry_run: discord.Option(
+                bool, "変更内容とAPI呼び出し数の確認のみ行います", default=False
+            ),
     ):
         # Adminに限定
         if not ctx.author.guild_permissions.administrator:
@@ -383,12 +549,16 @@ class ParticipantInfo(commands.Cog):
             )
             return
 
-        await ctx.send_modal(ModifyRoleCSVModal(title="ロール一括修正"))
+        await ctx.send_modal(ModifyRoleCSVModal(title="ロール一括修正", dry_run=dry_run))
 
 
-class ModifyRoleCSVModal(discord.ui.Modal):
-    def __init__(self, *args, **kwargs) -> None:
+class ModifyRoleCSVModal(InstrumentedModal):
+    # dry-runの一覧に使う文字数の上限（末尾の省略表記の分を空けておく）
+    MAX_MESSAGE_LENGTH = 1900
+
+    def __init__(self, *args, dry_run: bool = False, **kwargs) -> None:
         super().__init__(*args, **kwargs)
+        self.dry_run = dry_run
 
         self.add_item(discord.ui.InputText(label="csv", style=discord.InputTextStyle.long))
 
@@ -401,7 +571,7 @@ class ModifyRoleCSVModal(discord.ui.Modal):
         csv_lines = csv_data.split("\n")
 
         # ヘッダー取得
-        csv_header = csv_lines[0].split(",")
+        csv_header = next(csv.reader(csv_lines[:1]))
         # discord_user_idのインデックス取得
         discord_user_id_index = csv_header.index("discord_user_id")
         # discord_user_id_indexの次から最後までをロール名として取得
@@ -417,31 +587,87 @@ class ModifyRoleCSVModal(discord.ui.Modal):
         data = list(csv.DictReader(csv_lines[1:], fieldnames=csv_header))
         logging.info(data)
         logging.info(roles)
+
+        # 現在のロールとの差分を計算し、変更のあるメンバーのみを対象にする
+        operations = []
         for row in data:
             discord_user_id = int(row["discord_user_id"])
             member = interaction.guild.get_member(discord_user_id)
             if not member:
                 continue
+            added, removed = self._diff_roles(member, roles, row)
+            if added or removed:
+                operations.append((member, added, removed))
 
-            logging.info(f"member: {member.display_name}")
-
-            try:
-                for role in roles:
-                    if role.name == "@everyone":
-                        continue
-                    if row[role.name] == "1":
-                        logging.info(f"add role: {role.name} to {member.display_name}")
-                        await member.add_roles(role)
-                    else:
-                        logging.info(f"remove role: {role.name} from {member.display_name}")
-                        await member.remove_roles(role)
-            except discord.Forbidden:
-                continue
+        if self.dry_run:
+            await interaction.followup.send(
+                self._format_plan(operations, len(data)), ephemeral=True
+            )
+            return
 
-        await interaction.followup.send("ロールを修正しました", ephemeral=True)
+        async def apply(operation):
+            member, added, removed = operation
+            logging.info(
+                f"modify roles of {member.display_name}: "
+                f"+{[r.name for r in added]} -{[r.name for r in removed]}"
+            )
+            # 1メンバーにつき1回のAPI呼び出しでロールをまとめて置き換える
+            new_roles = (set(member.roles) | set(added)) - set(removed)
+            await member.edit(roles=[r for r in new_roles if not r.is_default()])
+
+        result = await run_bulk(
+            operations,
+            apply,
+            progress=edit_progress(interaction, "ロールを修正中"),
+        )
 
+        await interaction.edit_original_response(
+            content=result.summary(
+                f"ロールを修正しました（変更対象: {len(operations)}/{len(data)}名）",
+                lambda op: op[0].display_name,
+            )
+        )
 
-class ParticipantInputStartButton(discord.ui.View):
+    @staticmethod
+    def _diff_roles(
+        member: discord.Member, roles: list[discord.Role], row: dict
+    ) -> tuple[list[discord.Role], list[discord.Role]]:
+        """CSVの行と現在のロールを比較し、(付与するロール, 削除するロール)を返す"""
+        current = set(member.roles)
+        added = []
+        removed = []
+        for role in roles:
+            if role.is_default():
+                continue
+            wanted = (row.get(role.name) or "").strip() == "1"
+            if wanted and role not in current:
+                added.append(role)
+            elif not wanted and role in current:
+                removed.append(role)
+        return added, removed
+
+    def _format_plan(self, operations: list, row_count: int) -> str:
+        message = "### ロール修正の確認（dry-run）\n"
+        message += f"変更対象: {len(operations)}/{row_count}名 / "
+        message += f"API呼び出し数: {len(operations)}回\n"
+        if operations:
+            message += "```"
+            listed = 0
+            for member, added, removed in operations:
+                changes = [f"+{r.name}" for r in added] + [f"-{r.name}" for r in removed]
+                line = f"{member.display_name}: {' '.join(changes)}\n"
+                # メッセージの文字数上限（2000文字）に収める
+                if len(message) + len(line) > self.MAX_MESSAGE_LENGTH:
+                    break
+                message += line
+                listed += 1
+            if listed < len(operations):
+                message += f"...他{len(operations) - listed}名\n"
+            message += "```"
+        return message
+
+
+class ParticipantInputStartButton(InstrumentedView):
     def __init__(self):
         super().__init__(timeout=None)
 
@@ -451,6 +677,21 @@ class ParticipantInputStartButton(discord.ui.View):
         custom_id="start_participant_info_input",
     )
     async def callback(self, _b: discord.ui.Button, interaction: discord.Interaction):
+        try:
+            await group_cache.ensure_loaded()
+        except Exception as e:
+            await interaction.response.send_message(
+                "エラーが発生しました。再度お試しください。", ephemeral=True
+            )
+            raise e
+
+        if not group_cache.groups:
+            await interaction.response.send_message(
+                "選択可能な所属団体がありません。運営にお問い合わせください。",
+                ephemeral=True,
+            )
+            return
+
         await interaction.response.send_message(
             "### 以下から所属団体を選択してください：",
             ephemeral=True,
@@ -458,38 +699,60 @@ class ParticipantInputStartButton(discord.ui.View):
         )
 
 
-class GroupSelectorView(discord.ui.View):
-    def __init__(self):
+class GroupSelectorView(InstrumentedView):
+    # 1ページに表示する選択肢の数（Discordの上限）
+    PAGE_SIZE = 25
+
+    def __init__(self, page: int = 0):
         super().__init__(timeout=None)
 
+        groups = group_cache.groups
+        page_count = self.page_count()
+        self.page = min(max(page, 0), page_count - 1)
+        page_groups = groups[self.page * self.PAGE_SIZE:(self.page + 1) * self.PAGE_SIZE]
+
+        placeholder = "所属団体を選択してください"
+        if page_count > 1:
+            placeholder += f"（{self.page + 1}/{page_count}）"
+
+        if page_groups:
+            select = discord.ui.Select(
+                placeholder=placeholder,
+                options=[
+                    discord.SelectOption(label=group_name[:100], value=str(group_id))
+                    for group_id, group_name in page_groups
+                ],
+                custom_id="group_selector",
+                min_values=1,
+                max_values=1,
+            )
+            select.callback = partial(self.callback, select)
+            self.add_item(select)
+
+        # ページ送り（移動先のページをcustom_idに持たせ、どのインスタンスでも処理できるようにする）
+        if self.page > 0:
+            self._add_page_button("前へ", self.page - 1)
+        if self.page < page_count - 1:
+            self._add_page_button("次へ", self.page + 1)
+
+    @classmethod
+    def page_count(cls) -> int:
+        return max(-(-len(group_cache.groups) // cls.PAGE_SIZE), 1)
+
+    def _add_page_button(self, label: str, page: int):
+        button = discord.ui.Button(
+            label=label,
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"group_selector_page:{page}",
+        )
+        button.callback = partial(self.change_page, page)
+        self.add_item(button)
+
     @staticmethod
-    def get_group_names():
-        try:
-            with get_db() as db:
-                # activeなグループを取得
-                groups = (
-                    db.execute(
-                        select(Group)
-                        .where(Group.is_disabled.is_(False))
-                        .order_by(Group.id)
-                    )
-                    .scalars()
-                    .all()
-                )
-                return [(group.id, group.name) for group in groups]
-        except Exception:
-            return []
-
-    @discord.ui.select(
-        placeholder="所属団体を選択してください",
-        options=[
-            discord.SelectOption(label=group_name, value=str(group_id))
-            for group_id, group_name in get_group_names()
-        ],
-        custom_id="group_selector",
-        min_values=1,
-        max_values=1,
-    )
+    async def change_page(page: int, interaction: discord.Interaction):
+        await group_cache.ensure_loaded()
+        await interaction.response.edit_message(view=GroupSelectorView(page=page))
+
     async def callback(self, s: discord.ui.Select, interaction: discord.Interaction):
         # 遅延
         await interaction.response.defer(ephemeral=True)
@@ -498,42 +761,27 @@ class GroupSelectorView(discord.ui.View):
         group_id = int(s.values[0])
         author_id = interaction.user.id
 
-        try:
-            with get_db() as db:
-                # グループ取得
-                group = db.execute(select(Group).where(Group.id == group_id)).scalar()
-                if not group:
-                    await interaction.followup.send(
-                        "グループが見つかりません。再度選択してください。",
-                        ephemeral=True,
-                    )
-                    return
-
-                # セッションに保存
-                user_session = db.execute(
-                    select(UserSessionStorage).where(
-                        UserSessionStorage.user_id == author_id
-                    )
-                ).scalar()
-                if not user_session:
-                    user_session = UserSessionStorage(user_id=author_id, data={})
-                user_session.data["group_id"] = group_id
-                db.add(user_session)
-                db.commit()
-
-                await interaction.followup.send(
-                    f"### 続いて、他の情報入力を行ってください：",
-                    ephemeral=True,
-                    view=ParticipantInfoModalOpenButton(),
-                )
-        except Exception as e:
+        # キャッシュからグループ名を取得（DBの存在確認は登録時の外部キー制約で行う）
+        await group_cache.ensure_loaded()
+        group_name = group_cache.get_name(group_id)
+        if group_name is None:
             await interaction.followup.send(
-                f"エラーが発生しました。再度お試しください。", ephemeral=True
+                "グループが見つかりません。再度選択してください。",
+                ephemeral=True,
             )
-            raise e
+            return
 
+        # 入力途中の状態として保存
+        await wizard_state.update(author_id, group_id=group_id, group_name=group_name)
 
-class ParticipantInfoModalOpenButton(discord.ui.View):
+        await interaction.followup.send(
+            f"### 続いて、他の情報入力を行ってください：",
+            ephemeral=True,
+            view=ParticipantInfoModalOpenButton(),
+        )
+
+
+class ParticipantInfoModalOpenButton(InstrumentedView):
     def __init__(self):
         super().__init__(timeout=None)
 
@@ -548,7 +796,7 @@ class ParticipantInfoModalOpenButton(discord.ui.View):
         )
 
 
-class ParticipantInfoModal(discord.ui.Modal):
+class ParticipantInfoModal(InstrumentedModal):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
@@ -590,62 +838,43 @@ class ParticipantInfoModal(discord.ui.Modal):
             )
             return
 
-        # セッションに保存
+        # 入力途中の状態を取得
         author_id = interaction.user.id
-        try:
-            with get_db() as db:
-                user_session = db.execute(
-                    select(UserSessionStorage).where(
-                        UserSessionStorage.user_id == author_id
-                    )
-                ).scalar()
-                if not user_session:
-                    # セッションがない場合はエラー
-                    await interaction.followup.send(
-                        "団体名の入力にエラーがあります。再度初めからお試しください。",
-                        ephemeral=True,
-                    )
-                    return
-
-                # セッションに保存
-                group_id = user_session.data.get("group_id")
-
-                group_name = db.execute(
-                    select(Group.name).where(Group.id == group_id)
-                ).scalar()
-
-                if not group_name:
-                    await interaction.followup.send(
-                        "グループが見つかりません。再度お試しください。", ephemeral=True
-                    )
-                    return
-
-                data = {
-                    "last_name": last_name,
-                    "first_name": first_name,
-                    "github_url": github_url,
-                    "group_id": group_id,
-                }
-                user_session.data = data
-                db.commit()
+        state = await wizard_state.get(author_id)
 
+        if state is None:
+            # セッションがない場合はエラー
             await interaction.followup.send(
-                "### 以下の情報で登録しますか？\n"
-                f"> **名前:** {last_name} {first_name}\n"
-                f"> **GitHub:** {github_url}\n"
-                f"> **所属団体:** {group_name}",
+                "団体名の入力にエラーがあります。再度初めからお試しください。",
                 ephemeral=True,
-                view=ParticipantInfoConfirmButton(),
             )
+            return
 
-        except Exception as e:
+        group_name = state.get("group_name")
+        if not state.get("group_id") or not group_name:
             await interaction.followup.send(
-                "エラーが発生しました。再度お試しください。", ephemeral=True
+                "グループが見つかりません。再度お試しください。", ephemeral=True
             )
-            raise e
+            return
+
+        await wizard_state.update(
+            author_id,
+            last_name=last_name,
+            first_name=first_name,
+            github_url=github_url,
+        )
 
+        await interaction.followup.send(
+            "### 以下の情報で登録しますか？\n"
+            f"> **名前:** {last_name} {first_name}\n"
+            f"> **GitHub:** {github_url}\n"
+            f"> **所属団体:** {group_name}",
+            ephemeral=True,
+            view=ParticipantInfoConfirmButton(),
+        )
 
-class ParticipantInfoConfirmButton(discord.ui.View):
+
+class ParticipantInfoConfirmButton(InstrumentedView):
     def __init__(self):
         super().__init__(timeout=None)
 
@@ -658,94 +887,82 @@ class ParticipantInfoConfirmButton(discord.ui.View):
 
         # データ取得
         author_id = interaction.user.id
+        state = await wizard_state.get(author_id)
         try:
-            with get_db() as db:
-                user_session = db.execute(
-                    select(UserSessionStorage).where(
-                        UserSessionStorage.user_id == author_id
-                    )
-                ).scalar()
-                if not user_session:
-                    await interaction.followup.send(
-                        "セッションが見つかりません。再度お試しください。"
-                    )
-                    return
-
-                group_id = user_session.data.get("group_id")
-                if not group_id:
-                    await interaction.followup.send(
-                        "グループが見つかりません。再度お試しください。"
-                    )
-                    return
-
-                # データ取得
-                last_name = user_session.data.get("last_name")
-                first_name = user_session.data.get("first_name")
-                github_url = user_session.data.get("github_url")
-
-                logging.info(f"last_name: {last_name}")
-                logging.info(f"first_name: {first_name}")
-                logging.info(f"github_url: {github_url}")
-                logging.info(f"group_id: {group_id}")
-
-                # パラメータチェック
-                if not last_name or not first_name or not github_url:
-                    await interaction.followup.send(
-                        "未入力の項目があります。再度お試しください。", ephemeral=True
-                    )
-                    return
-
-                # データ登録
-                # 存在チェック
-                participant = db.execute(
-                    select(Participant).where(Participant.discord_user_id == author_id)
-                ).scalar()
-
-                github_user_name = re.search(r"https://github\.com/([^/]+)", github_url).group(1)
-
-                if participant:
-                    # 既存の場合は更新
-                    participant.last_name = last_name
-                    participant.first_name = first_name
-                    participant.github_user_name = github_user_name
-                    participant.group_id = group_id
-                    db.add(participant)
-                    db.commit()
-
-                    # メッセージ送信
-                    group = db.execute(
-                        select(Group).where(Group.id == group_id)
-                    ).scalar()
-                    await interaction.followup.send(
-                        f"### 更新しました！",
-                        ephemeral=True,
-                    )
-                else:
-                    # 新規登録
-                    db.add(
-                        Participant(
-                            last_name=last_name,
-                            first_name=first_name,
-                            group_id=group_id,
-                            github_user_name=github_user_name,
-                            discord_user_id=author_id,
-                        )
-                    )
-                    db.commit()
-                    group = db.execute(
-                        select(Group).where(Group.id == group_id)
-                    ).scalar()
-                    await interaction.followup.send(
-                        f"### 登録しました！",
-                        ephemeral=True,
-                    )
-
+            result = await run_db(self._register, author_id, state)
         except Exception as e:
             await interaction.followup.send(
                 "エラーが発生しました。再度お試しください。", ephemeral=True
             )
             raise e
 
+        if result == "no_session":
+            await interaction.followup.send(
+                "セッションが見つかりません。再度お試しください。"
+            )
+        elif result == "no_group":
+            await interaction.followup.send(
+                "グループが見つかりません。再度お試しください。"
+            )
+        elif result == "missing":
+            await interaction.followup.send(
+                "未入力の項目があります。再度お試しください。", ephemeral=True
+            )
+        elif result == "updated":
+            await wizard_state.delete(author_id)
+            await interaction.followup.send(
+                f"### 更新しました！",
+                ephemeral=True,
+            )
+        else:
+            await wizard_state.delete(author_id)
+            await interaction.followup.send(
+                f"### 登録しました！",
+                ephemeral=True,
+            )
+
+    @staticmethod
+    def _register(db, author_id: int, state: dict | None) -> str:
+        if state is None:
+            return "no_session"
+
+        group_id = state.get("group_id")
+        if not group_id:
+            return "no_group"
+
+        # データ取得
+        last_name = state.get("last_name")
+        first_name = state.get("first_name")
+        github_url = state.get("github_url")
+
+        logging.info(f"last_name: {last_name}")
+        logging.info(f"first_name: {first_name}")
+        logging.info(f"github_url: {github_url}")
+        logging.info(f"group_id: {group_id}")
+
+        # パラメータチェック
+        if not last_name or not first_name or not github_url:
+            return "missing"
+
+        github_user_name = re.search(r"https://github\.com/([^/]+)", github_url).group(1)
+
+        # データ登録（既存の場合は更新）
+        try:
+            created = repositories.upsert_participant(
+                db,
+                author_id,
+                last_name=last_name,
+                first_name=first_name,
+                github_user_name=github_user_name,
+                group_id=group_id,
+            )
+        except IntegrityError:
+            # 選択後にグループが削除された場合
+            db.rollback()
+            return "no_group"
+        db.commit()
+        return "created" if created else "updated"
+
 
 def setup(bot):
     return bot.add_cog(ParticipantInfo(bot))
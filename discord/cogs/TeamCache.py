@@ -0,0 +1,55 @@
+import discord
+from discord import slash_command
+from discord.ext import commands
+
+from util.team_cache import TEAM_ROLE_PREFIX, team_cache
+
+
+class TeamCache(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    # ロールが変化したメンバーのみ破棄
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            team_cache.invalidate(after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        team_cache.invalidate(member.id)
+
+    # チームロールの作成・名前変更・削除は全メンバーに影響するため全て破棄
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        if role.name.startswith(TEAM_ROLE_PREFIX):
+            team_cache.clear()
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name or before.position != after.position:
+            team_cache.clear()
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        if role.name.startswith(TEAM_ROLE_PREFIX):
+            team_cache.clear()
+
+    @slash_command(
+        name="team_cache_status", description="チームキャッシュの状態を表示します"
+    )
+    @commands.has_permissions(administrator=True)
+    async def team_cache_status(self, ctx):
+        stats = team_cache.stats()
+        message = "```"
+        message += f"エントリ数: {stats['size']}\n"
+        message += f"ヒット: {stats['hits']}\n"
+        message += f"ミス: {stats['misses']}\n"
+        message += f"ヒット率: {stats['hit_rate'] * 100:.1f}%\n"
+        message += f"破棄: {stats['invalidations']}\n"
+        message += "```"
+        await ctx.respond(message, ephemeral=True)
+
+
+def setup(bot):
+    return bot.add_cog(TeamCache(bot))
@@ -1,5 +1,6 @@
 import os
 from datetime import datetime
+from zoneinfo import ZoneInfo
 
 import discord
 
@@ -8,6 +9,43 @@ OWNER_ID = os.environ.get("DISCORD_OWNER_ID")
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN")
 
+# CSV出力等の添付ファイルサイズ上限（これを超える場合は圧縮する）
+ATTACHMENT_SIZE_LIMIT = int(os.environ.get("ATTACHMENT_SIZE_LIMIT", 10 * 1024 * 1024))
+
+# コマンドで入力された日時を解釈するタイムゾーン
+TIMEZONE = ZoneInfo(os.environ.get("TZ", "Asia/Tokyo"))
+
+# テキストチャットログの書き込みバッファ
+TEXT_LOG_BATCH_SIZE = int(os.environ.get("TEXT_LOG_BATCH_SIZE", 500))
+TEXT_LOG_FLUSH_INTERVAL = float(os.environ.get("TEXT_LOG_FLUSH_INTERVAL", 2.0))
+TEXT_LOG_MAX_QUEUE_SIZE = int(os.environ.get("TEXT_LOG_MAX_QUEUE_SIZE", 50000))
+
+# ロール付与等の一括操作の同時実行数と進捗表示の間隔（秒）
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 5))
+BULK_PROGRESS_INTERVAL = float(os.environ.get("BULK_PROGRESS_INTERVAL", 3.0))
+
+# 参加者情報入力の途中状態の保存先（memory: プロセス内, db: user_session_storage）
+WIZARD_STATE_BACKEND = os.environ.get("WIZARD_STATE_BACKEND", "memory")
+WIZARD_STATE_TTL = float(os.environ.get("WIZARD_STATE_TTL", 1800))
+WIZARD_STATE_MAX_SIZE = int(os.environ.get("WIZARD_STATE_MAX_SIZE", 10000))
+
+# ヘルスチェック・メトリクスのHTTPサーバ
+# （/poolや/metricsは認証なしで内部情報を返すため、既定ではループバックのみで
+# 待ち受ける。Prometheus等から参照する場合は0.0.0.0等を指定する）
+HEALTHCHECK_HOST = os.environ.get("HEALTHCHECK_HOST", "127.0.0.1")
+HEALTHCHECK_PORT = int(os.environ.get("HEALTHCHECK_PORT", 8080))
+
+# ヘルスチェック（readyzの結果のキャッシュ秒数、DB疎通確認のタイムアウト、
+# イベントループ遅延・書き込みキューの滞留の閾値）
+HEALTH_CACHE_TTL = float(os.environ.get("HEALTH_CACHE_TTL", 5.0))
+HEALTH_DB_TIMEOUT = float(os.environ.get("HEALTH_DB_TIMEOUT", 2.0))
+HEALTH_MAX_LOOP_LAG = float(os.environ.get("HEALTH_MAX_LOOP_LAG", 1.0))
+HEALTH_LIVENESS_MAX_LOOP_LAG = float(
+    os.environ.get("HEALTH_LIVENESS_MAX_LOOP_LAG", 30.0)
+)
+HEALTH_MAX_QUEUE_FILL = float(os.environ.get("HEALTH_MAX_QUEUE_FILL", 0.8))
+HEALTH_MAX_FLUSH_AGE = float(os.environ.get("HEALTH_MAX_FLUSH_AGE", 60.0))
+
 
 async def NOTIFY_TO_OWNER(bot, message: str):
     owner = await bot.fetch_user(OWNER_ID)
@@ -18,3 +56,13 @@ async def NOTIFY_TO_OWNER(bot, message: str):
         .add_field(name="Status", value=message)
         .set_footer(text=str(datetime.now())),
     )
+
+
+def parse_datetime(value: str | None) -> datetime | None:
+    """YYYY-MM-DD[ HH:MM[:SS]]形式の文字列を解釈する（タイムゾーン未指定はTIMEZONE）"""
+    if value is None or value.strip() == "":
+        return None
+    dt = datetime.fromisoformat(value.strip())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TIMEZONE)
+    return dt
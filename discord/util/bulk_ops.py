@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable
+
+import discord
+
+from config import bot_config
+from util.message_format import format_listing
+
+logger = logging.getLogger("BulkOps")
+
+
+class BulkResult:
+    """一括操作の結果"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.succeeded: list = []
+        self.failed: list[tuple[object, str]] = []
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def done(self) -> int:
+        return len(self.succeeded) + len(self.failed)
+
+    def summary(self, title: str, describe: Callable[[object], str] = str) -> str:
+        message = f"{title}\n"
+        message += f"成功: {len(self.succeeded)}件 / 失敗: {len(self.failed)}件"
+        message += f"（{self.elapsed:.1f}秒）"
+        if self.failed:
+            message += "\n" + format_listing(
+                [f"{describe(item)}: {reason}" for item, reason in self.failed]
+            )
+        return message
+
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, discord.Forbidden):
+        return "権限がありません"
+    if isinstance(e, discord.NotFound):
+        return "対象が見つかりません"
+    if isinstance(e, discord.HTTPException):
+        return f"HTTP {e.status}: {e.text}"
+    return repr(e)
+
+
+async def run_bulk(
+    items: Iterable,
+    action: Callable[[object], Awaitable],
+    progress: Callable[[BulkResult], Awaitable] | None = None,
+    concurrency: int | None = None,
+    progress_interval: float | None = None,
+) -> BulkResult:
+    """itemsの各要素にactionを並行数を制限して実行する
+
+    レート制限はdiscord.pyのHTTPクライアントがルートごとのバケットで待機するため、
+    ここでは同時実行数のみを制限する。失敗した要素は理由とともに記録し、処理を続ける。
+    """
+    items = list(items)
+    result = BulkResult(len(items))
+    semaphore = asyncio.Semaphore(concurrency or bot_config.BULK_CONCURRENCY)
+    interval = progress_interval or bot_config.BULK_PROGRESS_INTERVAL
+
+    async def run(item):
+        async with semaphore:
+            try:
+                await action(item)
+            except Exception as e:
+                logger.warning(f"bulk action failed for {item}: {e}")
+                result.failed.append((item, _describe_error(e)))
+            else:
+                result.succeeded.append(item)
+
+    async def report():
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await progress(result)
+            except discord.HTTPException as e:
+                logger.warning(f"Failed to report progress: {e}")
+
+    reporter = None
+    if progress is not None and items:
+        reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(*(run(item) for item in items))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+            # 進捗の編集が最終結果の表示を上書きしないよう、停止を待つ
+            await asyncio.gather(reporter, return_exceptions=True)
+
+    result.elapsed = time.perf_counter() - result.started_at
+    return result
+
+
+def edit_progress(interaction: discord.Interaction, title: str):
+    """遅延応答を編集して進捗を表示するコールバックを作成する"""
+
+    async def progress(result: BulkResult):
+        await interaction.edit_original_response(
+            content=f"{title}: {result.done}/{result.total}件"
+            f"（失敗{len(result.failed)}件）"
+        )
+
+    return progress
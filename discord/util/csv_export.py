@@ -0,0 +1,120 @@
+import asyncio
+import csv
+import gzip
+import io
+import shutil
+import tempfile
+from typing import Callable, Iterable
+
+import discord
+
+from config import bot_config
+from db.package.session import run_db
+
+# メモリ上に保持する上限（超えると一時ファイルに退避される）
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# サーバーサイドカーソルで一度に取得する行数
+YIELD_PER = 1000
+
+
+class ExportTooLargeError(Exception):
+    pass
+
+
+class CSVExport:
+    """CSVを一時ファイルに逐次書き込み、添付ファイルとして送信する"""
+
+    def __init__(self, filename: str, header: list[str]):
+        self.filename = filename
+        self.row_count = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self._compressed = None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._writer.writerow(header)
+        self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self):
+        self._file.write(self._buffer.getvalue().encode("utf-8"))
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def writerows(self, rows: Iterable):
+        for row in rows:
+            self._writer.writerow(row)
+            self.row_count += 1
+            if self._buffer.tell() >= 64 * 1024:
+                self._flush()
+        self._flush()
+
+    def write_query(self, db, stmt, row_fn: Callable | None = None):
+        """サーバーサイドカーソルで結果を少しずつ取得して書き込む
+
+        row_fnがNoneを返した行は出力しない。
+        """
+        result = db.execute(stmt.execution_options(yield_per=YIELD_PER))
+        rows = result if row_fn is None else map(row_fn, result)
+        self.writerows(row for row in rows if row is not None)
+
+    @property
+    def size(self) -> int:
+        return self._file.tell()
+
+    def to_file(self, size_limit: int) -> discord.File:
+        """添付ファイルを作成する（上限を超える場合はgzip圧縮する）"""
+        if self.size <= size_limit:
+            self._file.seek(0)
+            return discord.File(fp=self._file, filename=self.filename)
+
+        self._file.seek(0)
+        self._compressed = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        with gzip.GzipFile(
+            filename=self.filename, mode="wb", fileobj=self._compressed
+        ) as gz:
+            shutil.copyfileobj(self._file, gz)
+
+        if self._compressed.tell() > size_limit:
+            raise ExportTooLargeError(
+                f"{self.filename} is too large even after compression"
+            )
+
+        self._compressed.seek(0)
+        return discord.File(fp=self._compressed, filename=f"{self.filename}.gz")
+
+    def close(self):
+        self._file.close()
+        if self._compressed is not None:
+            self._compressed.close()
+
+
+def attachment_size_limit(guild: discord.Guild | None) -> int:
+    if guild is None:
+        return bot_config.ATTACHMENT_SIZE_LIMIT
+    return min(guild.filesize_limit, bot_config.ATTACHMENT_SIZE_LIMIT)
+
+
+async def send_csv(
+    send,
+    content: str,
+    guild: discord.Guild | None,
+    filename: str,
+    header: list[str],
+    stmt,
+    row_fn: Callable | None = None,
+    **kwargs,
+):
+    """クエリ結果をCSVとして書き出し、send(content, file=...)で送信する"""
+    with CSVExport(filename, header) as export:
+        await run_db(export.write_query, stmt, row_fn)
+        try:
+            file = await asyncio.to_thread(export.to_file, attachment_size_limit(guild))
+        except ExportTooLargeError:
+            await send("ファイルサイズが上限を超えるため送信できません", **kwargs)
+            return
+        await send(content, file=file, **kwargs)
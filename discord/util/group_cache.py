@@ -0,0 +1,53 @@
+import asyncio
+import logging
+
+from db.package import repositories
+from db.package.session import run_db
+
+
+class GroupCache:
+    """有効なグループ（ID, 名前）の一覧のキャッシュ"""
+
+    def __init__(self):
+        self._groups: list[tuple[int, str]] | None = None
+        self._names: dict[int, str] = {}
+        self._lock = asyncio.Lock()
+        self.loads = 0
+        self.invalidations = 0
+        self.logger = logging.getLogger("GroupCache")
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._groups is not None
+
+    @property
+    def groups(self) -> list[tuple[int, str]]:
+        """読み込み済みの一覧（未読み込みの場合は空）"""
+        return self._groups or []
+
+    def get_name(self, group_id: int) -> str | None:
+        return self._names.get(group_id)
+
+    @staticmethod
+    def _fetch(db) -> list[tuple[int, str]]:
+        return [(group.id, group.name) for group in repositories.list_active_groups(db)]
+
+    async def load(self):
+        async with self._lock:
+            groups = await run_db(self._fetch)
+            self._groups = groups
+            self._names = dict(groups)
+            self.loads += 1
+            self.logger.info(f"Loaded {len(groups)} group(s)")
+
+    async def ensure_loaded(self):
+        if not self.is_loaded:
+            await self.load()
+
+    def invalidate(self):
+        self._groups = None
+        self._names = {}
+        self.invalidations += 1
+
+
+group_cache = GroupCache()
@@ -0,0 +1,175 @@
+"""コマンド・リスナー・UIコールバックの処理時間の計測
+
+1回の呼び出しごとに経過時間・DB時間・Discord API時間を記録し、
+ハンドラごとに直近の記録からパーセンタイルを計算する。
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import wraps
+
+import discord
+from discord.webhook.async_ import AsyncWebhookAdapter
+
+# ハンドラごとに保持する直近の記録数
+WINDOW_SIZE = 1000
+
+
+class Invocation:
+    """1回の呼び出しで消費したDB・API時間"""
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.api_seconds = 0.0
+        # run_dbのスレッドからも加算されるためロックで保護する
+        self._lock = threading.Lock()
+
+    def add_db(self, seconds: float):
+        with self._lock:
+            self.db_seconds += seconds
+
+    def add_api(self, seconds: float):
+        with self._lock:
+            self.api_seconds += seconds
+
+
+# 実行中の呼び出し（run_dbはcontextvarsをスレッドに引き継ぐ）
+_current: contextvars.ContextVar[Invocation | None] = contextvars.ContextVar(
+    "handler_invocation", default=None
+)
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+class HandlerStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.max_seconds = 0.0
+        # (経過時間, DB時間, API時間)
+        self._samples: deque[tuple[float, float, float]] = deque(maxlen=WINDOW_SIZE)
+
+    def record(self, wall: float, db: float, api: float, error: bool):
+        self.count += 1
+        self.errors += int(error)
+        self.max_seconds = max(self.max_seconds, wall)
+        self._samples.append((wall, db, api))
+
+    def summary(self) -> dict:
+        walls = [s[0] for s in self._samples]
+        samples = len(self._samples) or 1
+        return {
+            "name": self.name,
+            "count": self.count,
+            "errors": self.errors,
+            "p50": _percentile(walls, 0.5),
+            "p95": _percentile(walls, 0.95),
+            "p99": _percentile(walls, 0.99),
+            "max": self.max_seconds,
+            "avg_db": sum(s[1] for s in self._samples) / samples,
+            "avg_api": sum(s[2] for s in self._samples) / samples,
+        }
+
+
+_stats: dict[str, HandlerStats] = {}
+
+
+@asynccontextmanager
+async def measure(name: str):
+    """ブロック内の処理時間を計測し、nameのハンドラの記録として保存する
+
+    入れ子の場合（on_interactionからのコマンド実行等）、DB・API時間は内側に計上する。
+    """
+    invocation = Invocation()
+    token = _current.set(invocation)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _current.reset(token)
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = HandlerStats(name)
+        stats.record(
+            time.perf_counter() - start,
+            invocation.db_seconds,
+            invocation.api_seconds,
+            error,
+        )
+
+
+def slowest(limit: int = 10, key: str = "p95") -> list[dict]:
+    summaries = [stats.summary() for stats in _stats.values()]
+    return sorted(summaries, key=lambda s: s[key], reverse=True)[:limit]
+
+
+def _add_db_time(statement: str, seconds: float):
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.add_db(seconds)
+
+
+def _timed_request(request):
+    @wraps(request)
+    async def wrapper(*args, **kwargs):
+        invocation = _current.get()
+        if invocation is None:
+            return await request(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            invocation.add_api(time.perf_counter() - start)
+
+    return wrapper
+
+
+def install(bot):
+    """DB時間とDiscord API時間の集計を設定する"""
+    from db.package import instrumentation
+
+    instrumentation.add_query_observer(_add_db_time)
+    # 通常のAPI呼び出しと、インタラクションの応答（Webhook経由）の両方を計測する
+    bot.http.request = _timed_request(bot.http.request)
+    if not getattr(AsyncWebhookAdapter.request, "__wrapped__", None):
+        AsyncWebhookAdapter.request = _timed_request(AsyncWebhookAdapter.request)
+
+
+class InstrumentedView(discord.ui.View):
+    """ボタン・セレクト等のコールバックを計測するView"""
+
+    async def _scheduled_task(self, item, interaction: discord.Interaction):
+        callback = getattr(item.callback, "func", item.callback)
+        name = f"{type(self).__name__}.{getattr(callback, '__name__', 'callback')}"
+        async with measure(name):
+            await super()._scheduled_task(item, interaction)
+
+
+class InstrumentedModal(discord.ui.Modal):
+    """送信時のコールバックを計測するModal"""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        callback = cls.__dict__.get("callback")
+        if callback is not None:
+            name = f"{cls.__name__}.callback"
+
+            @wraps(callback)
+            async def wrapper(self, interaction: discord.Interaction):
+                async with measure(name):
+                    await callback(self, interaction)
+
+            cls.callback = wrapper
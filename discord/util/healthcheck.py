@@ -1,32 +1,182 @@
+import asyncio
 import logging
+import math
+import time
 
 import discord
 from aiohttp import web
+from sqlalchemy import text
+
+from config import bot_config
+from db.package.connection import get_pool_stats
+from db.package.session import run_db
+from util import metrics, write_queue
+
+# イベントループの遅延を計測する間隔（秒）
+LOOP_LAG_INTERVAL = 0.5
 
 
 class HealthCheckServer:
-    def __init__(self, client: discord.Client, port: int, latency_threshold: float):
+    def __init__(
+        self, client: discord.Client, host: str, port: int, latency_threshold: float
+    ):
         self.client = client
+        self.host = host
         self.port = port
         self.latency_threshold = latency_threshold
         self.app = web.Application()
-        self.app.router.add_get("/", self.handle)
+        # 従来のヘルスチェックURLはreadyzと同じ扱いにする
+        self.app.router.add_get("/", self.handle_readyz)
+        self.app.router.add_get("/livez", self.handle_livez)
+        self.app.router.add_get("/readyz", self.handle_readyz)
+        self.app.router.add_get("/pool", self.handle_pool)
+        self.app.router.add_get("/metrics", self.handle_metrics)
         self.logger = logging.getLogger("HealthCheckServer")
 
-    async def handle(self, request):
-        if self.client.is_ready() and self.client.latency < self.latency_threshold:
-            return web.Response(text="OK")
-        else:
-            return web.Response(status=500, text="NOT OK")
+        self.loop_lag = 0.0
+        self.loop_lag_checked_at = time.monotonic()
+        self._lag_task: asyncio.Task | None = None
+
+        # readyzの結果のキャッシュ（頻繁なプローブでDBにアクセスしないため）
+        self._ready_result: tuple[bool, dict] | None = None
+        self._ready_checked_at = 0.0
+        self._ready_task: asyncio.Task | None = None
+
+    async def _measure_loop_lag(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            self.loop_lag = max(now - start - LOOP_LAG_INTERVAL, 0.0)
+            self.loop_lag_checked_at = now
+
+    def _current_loop_lag(self) -> float:
+        # 計測タスク自体が止まっている場合は最後の計測からの経過時間を遅延とみなす
+        overdue = time.monotonic() - self.loop_lag_checked_at - LOOP_LAG_INTERVAL
+        return max(self.loop_lag, overdue, 0.0)
+
+    async def handle_livez(self, request):
+        # プロセスが応答でき、イベントループが詰まっていなければ生存とみなす
+        loop_lag = self._current_loop_lag()
+        alive = not self.client.is_closed() and (
+            loop_lag < bot_config.HEALTH_LIVENESS_MAX_LOOP_LAG
+        )
+        return web.json_response(
+            {"status": "ok" if alive else "ng", "loop_lag": loop_lag},
+            status=200 if alive else 500,
+        )
+
+    async def handle_readyz(self, request):
+        ready, checks = await self._get_readiness()
+        return web.json_response(
+            {"status": "ok" if ready else "ng", "checks": checks},
+            status=200 if ready else 503,
+        )
+
+    async def _get_readiness(self) -> tuple[bool, dict]:
+        if (
+            self._ready_result is not None
+            and time.monotonic() - self._ready_checked_at < bot_config.HEALTH_CACHE_TTL
+        ):
+            return self._ready_result
+
+        # 同時に来たプローブは実行中のチェックを共有する
+        if self._ready_task is None or self._ready_task.done():
+            self._ready_task = asyncio.create_task(self._check_readiness())
+        return await asyncio.shield(self._ready_task)
+
+    async def _check_readiness(self) -> tuple[bool, dict]:
+        checks = {
+            "gateway": self._check_gateway(),
+            "loop_lag": self._check_loop_lag(),
+            "write_queues": self._check_write_queues(),
+            "db": await self._check_db(),
+        }
+        ready = all(check["ok"] for check in checks.values())
+        self._ready_result = (ready, checks)
+        self._ready_checked_at = time.monotonic()
+        if not ready:
+            failed = [name for name, check in checks.items() if not check["ok"]]
+            self.logger.warning(f"Not ready: {', '.join(failed)}")
+        return self._ready_result
+
+    def _check_gateway(self) -> dict:
+        latency = self.client.latency
+        ok = (
+            self.client.is_ready()
+            and not math.isnan(latency)
+            and latency < self.latency_threshold
+        )
+        return {"ok": ok, "latency": None if math.isnan(latency) else latency}
+
+    def _check_loop_lag(self) -> dict:
+        loop_lag = self._current_loop_lag()
+        return {"ok": loop_lag < bot_config.HEALTH_MAX_LOOP_LAG, "lag": loop_lag}
+
+    @staticmethod
+    def _check_write_queues() -> dict:
+        now = time.time()
+        queues = {}
+        ok = True
+        for queue in write_queue.get_queues():
+            stats = queue.stats()
+            fill = stats["depth"] / queue.max_size
+            # 行が待ったまま書き込みが進んでいない場合も異常とする
+            pending_age = (
+                now - stats["pending_since"] if stats["pending_since"] else None
+            )
+            stalled = (
+                pending_age is not None
+                and pending_age > bot_config.HEALTH_MAX_FLUSH_AGE
+            )
+            queue_ok = fill < bot_config.HEALTH_MAX_QUEUE_FILL and not stalled
+            ok = ok and queue_ok
+            queues[queue.name] = {
+                "ok": queue_ok,
+                "depth": stats["depth"],
+                "fill": fill,
+                "pending_age": pending_age,
+            }
+        return {"ok": ok, "queues": queues}
+
+    @staticmethod
+    async def _check_db() -> dict:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                run_db(lambda db: db.execute(text("SELECT 1")).scalar()),
+                bot_config.HEALTH_DB_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            return {"ok": False, "error": "timeout"}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "seconds": time.perf_counter() - start}
+
+    async def handle_pool(self, request):
+        return web.json_response(get_pool_stats())
+
+    async def handle_metrics(self, request):
+        return web.Response(text=metrics.registry.render(), content_type="text/plain")
 
     async def start(self):
+        self._lag_task = asyncio.create_task(self._measure_loop_lag())
         runner = web.AppRunner(self.app)
         await runner.setup()
-        site = web.TCPSite(runner, "localhost", self.port)
+        site = web.TCPSite(runner, self.host, self.port)
         await site.start()
-        self.logger.info(f"Health check server started on port {self.port}")
+        self.logger.info(f"Health check server started on {self.host}:{self.port}")
+
+
+_server: HealthCheckServer | None = None
 
 
-async def start_server(client: discord.Client, port: int, latency_threshold: float):
-    server = HealthCheckServer(client, port, latency_threshold)
-    await server.start()
+async def start_server(
+    client: discord.Client, host: str, port: int, latency_threshold: float
+):
+    global _server
+    # 再接続でon_readyが再度呼ばれても二重に起動しない
+    if _server is not None:
+        return
+    _server = HealthCheckServer(client, host, port, latency_threshold)
+    await _server.start()
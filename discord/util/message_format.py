@@ -0,0 +1,13 @@
+# コードブロックに列挙する件数の上限（メッセージの文字数制限対策）
+MAX_LISTED_LINES = 20
+
+
+def format_listing(lines: list[str], limit: int = MAX_LISTED_LINES) -> str:
+    """先頭limit件をコードブロックに列挙し、残りは件数のみ表示する"""
+    message = "```"
+    for line in lines[:limit]:
+        message += f"{line}\n"
+    if len(lines) > limit:
+        message += f"...他{len(lines) - limit}件\n"
+    message += "```"
+    return message
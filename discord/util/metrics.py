@@ -0,0 +1,319 @@
+"""Prometheusのテキスト形式で出力する最小限のメトリクス"""
+
+import logging
+import math
+import threading
+import time
+from typing import Callable
+
+# ハンドラやクエリの処理時間（秒）のバケット
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # DBのイベントはスレッドプールから呼ばれるためロックで保護する
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple, **extra) -> dict:
+        return {**dict(zip(self.labelnames, key)), **extra}
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        # callback() -> {ラベルのタプル: 値}（他のモジュールが持つ累計値を出力する場合）
+        self.callback: Callable[[], dict] | None = callback
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.callback is not None:
+            values.update(self.callback())
+        return [(self.name, self._labels(key), value) for key, value in values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # ラベル -> (バケットごとの件数, 合計, 件数)
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(c), t, n) for key, (c, t, n) in self._values.items()}
+
+        samples = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                samples.append(
+                    (f"{self.name}_bucket", self._labels(key, le=le), cumulative)
+                )
+            samples.append((f"{self.name}_sum", self._labels(key), total))
+            samples.append((f"{self.name}_count", self._labels(key), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+gateway_latency = registry.register(
+    Gauge("discord_gateway_latency_seconds", "Discord gateway heartbeat latency")
+)
+events_total = registry.register(
+    Counter("discord_events_total", "Dispatched Discord events", ("event",))
+)
+listener_duration = registry.register(
+    Histogram(
+        "discord_listener_duration_seconds",
+        "Event listener handling time",
+        ("listener",),
+    )
+)
+command_duration = registry.register(
+    Histogram(
+        "discord_command_duration_seconds",
+        "Slash command handling time",
+        ("command", "status"),
+    )
+)
+db_query_duration = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Database statement execution time",
+        ("operation",),
+    )
+)
+write_queue_depth = registry.register(
+    Gauge("write_queue_depth", "Rows waiting in the write-behind queue", ("queue",))
+)
+write_queue_rows = registry.register(
+    Counter(
+        "write_queue_rows_total",
+        "Rows handled by the write-behind queue",
+        ("queue", "result"),
+    )
+)
+write_queue_failed_flushes = registry.register(
+    Counter(
+        "write_queue_failed_flushes_total",
+        "Failed batch writes of the write-behind queue",
+        ("queue",),
+    )
+)
+db_pool_connections = registry.register(
+    Gauge("db_pool_connections", "Database pool connections", ("state",))
+)
+db_pool_wait = registry.register(
+    Counter(
+        "db_pool_checkout_wait_seconds_total",
+        "Time spent waiting for a database pool connection",
+    )
+)
+rate_limit_hits = registry.register(
+    Counter(
+        "discord_rate_limit_hits_total",
+        "HTTP 429 responses from the Discord API",
+    )
+)
+rate_limit_global_hits = registry.register(
+    Counter(
+        "discord_rate_limit_global_hits_total",
+        "HTTP 429 responses from the Discord API that hit the global rate limit",
+    )
+)
+rate_limit_wait = registry.register(
+    Counter(
+        "discord_rate_limit_wait_seconds_total",
+        "Time spent waiting for Discord API rate limits",
+    )
+)
+
+
+# Discord HTTPクライアントのレート制限
+class RateLimitLogHandler(logging.Handler):
+    """discord.httpのレート制限の警告ログを数える
+
+    429のたびに"We are being rate limited"が出力され、グローバルなレート制限の場合は
+    続けて"Global rate limit has been hit"も出力されるため、後者は内訳として別に数える。
+    """
+
+    def emit(self, record: logging.LogRecord):
+        if not isinstance(record.msg, str):
+            return
+        if record.msg.startswith("We are being rate limited"):
+            rate_limit_hits.inc()
+            if record.args:
+                rate_limit_wait.inc(float(record.args[0]))
+        elif record.msg.startswith("Global rate limit has been hit"):
+            rate_limit_global_hits.inc()
+
+
+# DBクエリ
+def observe_query(statement: str, elapsed: float):
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    db_query_duration.observe(elapsed, operation=operation)
+
+
+# スラッシュコマンド
+_command_started: dict[int, float] = {}
+
+
+async def on_application_command(ctx):
+    _command_started[ctx.interaction.id] = time.perf_counter()
+
+
+def _observe_command(ctx, status: str):
+    started = _command_started.pop(ctx.interaction.id, None)
+    if started is not None and ctx.command is not None:
+        command_duration.observe(
+            time.perf_counter() - started,
+            command=ctx.command.qualified_name,
+            status=status,
+        )
+
+
+async def on_application_command_completion(ctx):
+    _observe_command(ctx, "success")
+
+
+async def on_application_command_error(ctx, error):
+    _observe_command(ctx, "error")
+
+
+def install(bot):
+    """Botに各種メトリクスの収集を設定する"""
+    from db.package import instrumentation
+    from db.package.connection import get_pool_stats
+    from util import write_queue
+
+    gateway_latency.callback = lambda: (
+        {(): bot.latency} if not math.isnan(bot.latency) else {}
+    )
+    write_queue_depth.callback = lambda: {
+        (queue.name,): queue.depth for queue in write_queue.get_queues()
+    }
+
+    def queue_rows():
+        values = {}
+        for queue in write_queue.get_queues():
+            stats = queue.stats()
+            for result in ("enqueued", "flushed", "failed", "dropped"):
+                values[(queue.name, result)] = stats[f"{result}_total"]
+        return values
+
+    write_queue_rows.callback = queue_rows
+    write_queue_failed_flushes.callback = lambda: {
+        (queue.name,): queue.failed_flush_count for queue in write_queue.get_queues()
+    }
+
+    def pool_connections():
+        stats = get_pool_stats()
+        return {
+            (state,): stats[state]
+            for state in ("checked_in", "checked_out", "overflow")
+        }
+
+    db_pool_connections.callback = pool_connections
+    db_pool_wait.callback = lambda: {(): get_pool_stats()["total_wait_seconds"]}
+
+    logging.getLogger("discord.http").addHandler(RateLimitLogHandler())
+    instrumentation.add_query_observer(observe_query)
+
+    bot.add_listener(on_application_command)
+    bot.add_listener(on_application_command_completion)
+    bot.add_listener(on_application_command_error)
@@ -0,0 +1,54 @@
+import discord
+
+# チームロールの接頭辞
+TEAM_ROLE_PREFIX = "チーム"
+
+
+def resolve_team_id(member: discord.Member) -> str | None:
+    """メンバーのロールから"チーム"で始まるものを取得し、その後の文字列をチームIDとする"""
+    for role in member.roles:
+        if role.name.startswith(TEAM_ROLE_PREFIX):
+            return role.name.removeprefix(TEAM_ROLE_PREFIX)
+    return None
+
+
+class TeamCache:
+    """メンバーID -> チームIDのキャッシュ"""
+
+    def __init__(self):
+        self._teams: dict[int, str | None] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, member: discord.Member) -> str | None:
+        if member.id in self._teams:
+            self.hits += 1
+            return self._teams[member.id]
+
+        self.misses += 1
+        team_id = resolve_team_id(member)
+        self._teams[member.id] = team_id
+        return team_id
+
+    def invalidate(self, member_id: int):
+        if member_id in self._teams:
+            del self._teams[member_id]
+            self.invalidations += 1
+
+    def clear(self):
+        self._teams.clear()
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._teams),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+team_cache = TeamCache()
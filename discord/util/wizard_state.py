@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import discord
+
+from config import bot_config
+from db.package import repositories
+from db.package.session import run_db
+
+
+class TTLCacheStore:
+    """プロセス内で保持する入力途中の状態（TTL付き・件数上限を超えるとLRUで破棄）"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self.evictions = 0
+
+    def _get(self, user_id: int) -> dict | None:
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return data
+
+    async def get(self, user_id: int) -> dict | None:
+        data = self._get(user_id)
+        return dict(data) if data is not None else None
+
+    async def update(self, user_id: int, **values) -> dict:
+        data = {**(self._get(user_id) or {}), **values}
+        self._data[user_id] = (time.monotonic() + self.ttl, data)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        return dict(data)
+
+    async def delete(self, user_id: int):
+        self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "evictions": self.evictions,
+        }
+
+
+class DBStore:
+    """user_session_storageに保存する入力途中の状態（複数プロセスで動かす場合用）"""
+
+    # 期限切れの行を削除する間隔（秒）
+    CLEANUP_INTERVAL = 600
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._last_cleanup = 0.0
+
+    def _expires_before(self):
+        return discord.utils.utcnow() - timedelta(seconds=self.ttl)
+
+    async def get(self, user_id: int) -> dict | None:
+        user_session = await run_db(
+            repositories.get_session, user_id, self._expires_before()
+        )
+        return dict(user_session.data or {}) if user_session else None
+
+    async def update(self, user_id: int, **values) -> dict:
+        await self._cleanup_if_needed()
+        # 期限切れのデータは引き継がない
+        data = {**(await self.get(user_id) or {}), **values}
+        await run_db(self._save, user_id, data)
+        return data
+
+    @staticmethod
+    def _save(db, user_id: int, data: dict):
+        repositories.save_session_data(db, user_id, data)
+        db.commit()
+
+    async def delete(self, user_id: int):
+        await run_db(self._delete, user_id)
+
+    @staticmethod
+    def _delete(db, user_id: int):
+        repositories.delete_session(db, user_id)
+        db.commit()
+
+    async def _cleanup_if_needed(self):
+        if time.monotonic() - self._last_cleanup < self.CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = time.monotonic()
+        await run_db(self._cleanup, self._expires_before())
+
+    @staticmethod
+    def _cleanup(db, before) -> int:
+        count = repositories.delete_sessions_before(db, before)
+        db.commit()
+        return count
+
+    def stats(self) -> dict:
+        return {"backend": "db"}
+
+
+def create_store():
+    if bot_config.WIZARD_STATE_BACKEND == "db":
+        return DBStore(bot_config.WIZARD_STATE_TTL)
+    return TTLCacheStore(bot_config.WIZARD_STATE_TTL, bot_config.WIZARD_STATE_MAX_SIZE)
+
+
+# 参加者情報入力ウィザードの状態
+wizard_state = create_store()
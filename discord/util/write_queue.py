@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import insert
+
+from db.package.session import run_db
+
+# 稼働中のキュー（シャットダウン時にまとめてフラッシュする）
+_queues: list["WriteBehindQueue"] = []
+
+
+class WriteBehindQueue:
+    """ORMモデルの行をバッファし、件数または時間でまとめてbulk insertする"""
+
+    def __init__(
+        self,
+        model,
+        name: str,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+        max_size: int = 50000,
+        after_write=None,
+    ):
+        self.model = model
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        # after_write(db, batch): 同じトランザクション内で派生テーブルを更新するフック
+        self.after_write = after_write
+        self.logger = logging.getLogger(f"WriteBehindQueue.{name}")
+
+        self._buffer: list[dict] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        # バッファ先頭の、失敗して戻された（failed_totalに数え済みの）行数
+        self._retrying = 0
+
+        # カウンタ
+        self.enqueued_total = 0
+        self.flushed_total = 0
+        # 書き込みに失敗した行数（再試行で再び失敗しても1行は1回のみ数える）と、
+        # 失敗したフラッシュの回数
+        self.failed_total = 0
+        self.failed_flush_count = 0
+        self.dropped_total = 0
+        self.flush_count = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.last_flush_at: float | None = None
+        # 行が書き込まれずに待っている起点（空のバッファに行が入った時刻か、
+        # 行が残ったまま書き込みが進んだ時刻）。バッファが空の場合はNone
+        self.pending_since: float | None = None
+
+        _queues.append(self)
+
+    @property
+    def depth(self) -> int:
+        return len(self._buffer)
+
+    def put(self, row: dict):
+        if self._closed:
+            # シャットダウン中もイベントは届くため、例外にせず破棄して記録する
+            self.dropped_total += 1
+            self.logger.warning(f"Dropped a row after close: {row}")
+            return
+
+        # 上限を超えた場合は新しい行を捨てる（メモリを有界に保つ）
+        if len(self._buffer) >= self.max_size:
+            self.dropped_total += 1
+            return
+
+        if not self._buffer:
+            self.pending_since = time.time()
+        self._buffer.append(row)
+        self.enqueued_total += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(
+                self._run(), name=f"write_behind_queue: {self.name}"
+            )
+
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _write(self, db, batch: list[dict]):
+        db.execute(insert(self.model), batch)
+        if self.after_write is not None:
+            self.after_write(db, batch)
+        db.commit()
+
+    async def flush(self):
+        """バッファ内の行をbatch_size件ずつ書き込む"""
+        async with self._lock:
+            while self._buffer:
+                batch = self._buffer[: self.batch_size]
+                del self._buffer[: self.batch_size]
+                retried = min(self._retrying, len(batch))
+                self._retrying -= retried
+
+                start = time.perf_counter()
+                try:
+                    await run_db(self._write, batch)
+                except Exception as e:
+                    self.failed_total += len(batch) - retried
+                    self.failed_flush_count += 1
+                    self.logger.error(f"Failed to flush {len(batch)} row(s): {e}")
+                    # 失敗したバッチは先頭に戻し、次回のフラッシュで再試行する
+                    room = self.max_size - len(self._buffer)
+                    self._buffer[:0] = batch[:room]
+                    self._retrying += min(len(batch), room)
+                    self.dropped_total += max(len(batch) - room, 0)
+                    break
+
+                elapsed = time.perf_counter() - start
+                self.flushed_total += len(batch)
+                self.flush_count += 1
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                self.total_flush_seconds += elapsed
+                self.last_flush_at = time.time()
+                self.pending_since = self.last_flush_at if self._buffer else None
+
+    async def close(self):
+        """フラッシュタスクを停止し、残りの行を書き込む"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+        if self in _queues:
+            _queues.remove(self)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "depth": self.depth,
+            "enqueued_total": self.enqueued_total,
+            "flushed_total": self.flushed_total,
+            "failed_total": self.failed_total,
+            "failed_flush_count": self.failed_flush_count,
+            "dropped_total": self.dropped_total,
+            "flush_count": self.flush_count,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": (
+                self.total_flush_seconds / self.flush_count if self.flush_count else 0.0
+            ),
+            "last_flush_at": self.last_flush_at,
+            "pending_since": self.pending_since,
+        }
+
+
+def get_queues() -> list[WriteBehindQueue]:
+    return list(_queues)
+
+
+async def close_all():
+    for queue in get_queues():
+        await queue.close()